@@ -0,0 +1,218 @@
+"""Benchmark dos loaders e gráficos do funcoes.py em volumes de dados escalados
+
+Uso: python benchmark.py [--escalas 1,10,100,1000] [--repeticoes 3] [--saida benchmark.json]
+                         [--comparar benchmark_anterior.json]
+
+Gera dados sintéticos com o formato das duas planilhas do projeto (reamostrando
+as linhas reais), mede tempo e pico de memória de cada etapa e grava tudo em
+JSON. Com --comparar, mostra a razão de tempo em relação a um resultado anterior.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import funcoes
+from relatorio import GRAFICOS, argumentos_nomeados
+
+# Acima deste número de linhas os loaders de Excel não são medidos (gravar e ler a
+# planilha sintética levaria minutos; o Excel aceita no máximo 1.048.576 linhas)
+MAX_LINHAS_EXCEL = 50_000
+
+def gerar_navios(df_base, escala, semente=0):
+    """Reamostra a planilha de navios em escala vezes, espalhando as cópias por até 10 anos"""
+    rng = np.random.default_rng(semente)
+    n = int(round(len(df_base) * escala))
+    indices = rng.integers(0, len(df_base), n)
+    df = df_base.iloc[indices].reset_index(drop=True)
+
+    copia = np.arange(n) // len(df_base)
+    deslocamento = pd.to_timedelta((copia % 10) * 365, unit='D') + pd.to_timedelta(rng.integers(-720, 720, n), unit='min')
+    for coluna in ['Chegada na Barra', 'Atracação', 'Início Operação', 'Fim Operação', 'Desatracação']:
+        df[coluna] = pd.to_datetime(df[coluna]) + deslocamento
+    df['Navio / Viagem'] = df['Navio / Viagem'].astype(str) + '-' + copia.astype(str)
+    return df
+
+def gerar_comex(df_base, escala, semente=0):
+    """Reamostra a planilha do Comex Stat em escala vezes, com valores perturbados e mais municípios"""
+    # Textos como categóricas e colunas montadas uma a uma, para a reamostragem
+    # não multiplicar strings nem copiar blocos inteiros na memória
+    df_base = df_base.astype({coluna: 'category' for coluna in df_base.columns[df_base.dtypes == object]})
+    rng = np.random.default_rng(semente)
+    n = int(round(len(df_base) * escala))
+    indices = rng.integers(0, len(df_base), n)
+    copia = np.arange(n) // len(df_base)
+
+    colunas = {}
+    for coluna in df_base.columns:
+        valores = df_base[coluna].iloc[indices].reset_index(drop=True)
+        if coluna == 'Município':
+            categorias = [f"{m} {v}" if v else m for m in valores.cat.categories for v in range(50)]
+            valores = pd.Categorical.from_codes(valores.cat.codes.to_numpy() * 50 + copia % 50, categorias)
+        elif coluna.startswith(('Exportação', 'Importação')):
+            valores = np.rint(valores.to_numpy() * rng.lognormal(0, 0.3, n)).astype('int32')
+        colunas[coluna] = valores
+    return pd.DataFrame(colunas)
+
+def medir(funcao, repeticoes):
+    """Executa funcao repetidas vezes; retorna tempos (s), pico de memória (MB) e o resultado
+
+    Os tempos vêm de execuções sem tracemalloc (que deixa o código bem mais lento);
+    o pico de memória vem de uma execução extra com tracemalloc ligado.
+    """
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+        del resultado
+
+    tracemalloc.start()
+    try:
+        resultado = funcao()
+        pico = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'tempo_min_s': min(tempos),
+        'tempo_mediana_s': statistics.median(tempos),
+        'pico_memoria_mb': pico / 1e6,
+    }, resultado
+
+def executar_escala(escala, base_navios, base_comex, repeticoes, diretorio):
+    """Mede todas as etapas em uma escala; retorna a lista de resultados"""
+    resultados = []
+
+    def registrar(etapa, linhas, funcao, repeticoes_etapa=repeticoes):
+        medida, resultado = medir(funcao, repeticoes_etapa)
+        resultados.append({'escala': escala, 'etapa': etapa, 'linhas': linhas, **medida})
+        print(f"  {etapa:<46} {medida['tempo_mediana_s'] * 1000:10.1f} ms {medida['pico_memoria_mb']:10.1f} MB")
+        return resultado
+
+    navios_brutos = gerar_navios(base_navios, escala)
+    comex_brutos = gerar_comex(base_comex, escala)
+
+    # Loaders (só até MAX_LINHAS_EXCEL linhas)
+    if len(navios_brutos) <= MAX_LINHAS_EXCEL:
+        path = os.path.join(diretorio, f"navios_{escala}.xlsx")
+        navios_brutos.to_excel(path, index=False)
+        registrar('load_data', len(navios_brutos), lambda: funcoes.load_data(path, usar_cache=False), 1)
+        registrar('load_data_em_blocos', len(navios_brutos),
+                  lambda: funcoes.load_data_em_blocos(path, usar_cache=False), 1)
+        funcoes.load_data(path)
+        registrar('load_data (cache Parquet)', len(navios_brutos), lambda: funcoes.load_data(path))
+    if len(comex_brutos) <= MAX_LINHAS_EXCEL:
+        path = os.path.join(diretorio, f"comex_{escala}.xlsx")
+        comex_brutos.to_excel(path, index=False)
+        registrar('carregar_dados_comex', len(comex_brutos),
+                  lambda: funcoes.carregar_dados_comex(path, usar_cache=False), 1)
+        funcoes.carregar_dados_comex(path)
+    else:
+        # Sem a planilha, o cache é gravado direto (a chave vem de um arquivo de origem qualquer)
+        path = os.path.join(diretorio, f"comex_{escala}.origem")
+        with open(path, 'wb') as arquivo:
+            arquivo.write(str(escala).encode())
+        funcoes.gravar_cache(path, 'comex', funcoes._processar_comex(comex_brutos.copy()))
+    registrar('carregar_dados_comex (cache Parquet)', len(comex_brutos), lambda: funcoes.carregar_dados_comex(path))
+
+    # Base particionada do Comex Stat (leitura de um ano, como no carregar_comex_base)
+    raiz_comex = os.path.join(diretorio, f"comex_particoes_{escala}")
+    funcoes.gravar_particoes_comex(comex_brutos, raiz_comex)
+    registrar('ler_particoes_comex', len(comex_brutos), lambda: funcoes.ler_particoes_comex(raiz_comex))
+
+    # Transformações e gráficos sobre os dados em memória
+    df = registrar('processamento navios', len(navios_brutos),
+                   lambda: funcoes.processar_dados_navios_hipoteses(funcoes._processar_navios(navios_brutos.copy())))
+    df_comex = registrar('processamento comex', len(comex_brutos),
+                         lambda: funcoes._processar_comex(comex_brutos.copy()))
+    registrar('remover_outliers_iqr', len(df), lambda: funcoes.remover_outliers_iqr(df, 'Tempo Estadia Porto'))
+    cubo = registrar('calcular_cubo_mensal', len(df), lambda: funcoes.calcular_cubo_mensal(df))
+    rollups = registrar('calcular_rollups_comex', len(df_comex), lambda: funcoes.calcular_rollups_comex(df_comex))
+
+    # Como no dashboard e no relatório: o cubo vai por nome a quem aceita
+    dados = {'navios': (df,), 'comex': (df_comex, rollups)}
+    agregacoes = {'cubo': cubo}
+    for _, nome_funcao, fonte in GRAFICOS:
+        funcao = getattr(funcoes, nome_funcao)
+        linhas = len(dados[fonte][0])
+        registrar(nome_funcao, linhas, lambda: funcao(*dados[fonte], **argumentos_nomeados(funcao, agregacoes)))
+
+    # Os builders recebem também a versão sem as pré-agregações, como eram chamados antes
+    for nome_funcao in ['grafico_hipoteses', 'grafico_concentracao_pais']:
+        fonte = 'navios' if nome_funcao == 'grafico_hipoteses' else 'comex'
+        registrar(f"{nome_funcao} (sem pré-agregação)", len(dados[fonte][0]),
+                  lambda: getattr(funcoes, nome_funcao)(dados[fonte][0]))
+
+    return resultados
+
+def comparar(atual, anterior, limite=1.2):
+    """Imprime a razão de tempo atual/anterior por etapa e escala; retorna as regressões"""
+    referencia = {(r['escala'], r['etapa']): r for r in anterior['resultados']}
+    regressoes = []
+    print(f"\n{'escala':>7} {'etapa':<46} {'razão':>7}")
+    for resultado in atual['resultados']:
+        antigo = referencia.get((resultado['escala'], resultado['etapa']))
+        if antigo is None or antigo['tempo_mediana_s'] == 0:
+            continue
+        razao = resultado['tempo_mediana_s'] / antigo['tempo_mediana_s']
+        marca = '  <- regressão' if razao > limite else ''
+        print(f"{resultado['escala']:>7} {resultado['etapa']:<46} {razao:7.2f}{marca}")
+        if razao > limite:
+            regressoes.append((resultado['escala'], resultado['etapa'], razao))
+    return regressoes
+
+def executar_benchmark(escalas, repeticoes=3, path_navios='dados_2024_wilson.xlsx', path_comex='dados_comex.xlsx'):
+    """Executa o benchmark em todas as escalas e retorna o resultado serializável"""
+    base_navios = pd.read_excel(path_navios)
+    base_comex = pd.read_excel(path_comex)
+    diretorio = tempfile.mkdtemp(prefix='benchmark_portuario_')
+    try:
+        resultados = []
+        for escala in escalas:
+            print(f"Escala {escala}x")
+            resultados.extend(executar_escala(escala, base_navios, base_comex, repeticoes, diretorio))
+    finally:
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+    return {
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'ambiente': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'plataforma': platform.platform(),
+        },
+        'escalas': escalas,
+        'repeticoes': repeticoes,
+        'resultados': resultados,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark dos loaders e gráficos em dados escalados')
+    parser.add_argument('--escalas', default='1,10,100,1000', help='fatores de escala separados por vírgula')
+    parser.add_argument('--repeticoes', type=int, default=3)
+    parser.add_argument('--saida', default='benchmark.json', help='arquivo JSON com os resultados')
+    parser.add_argument('--comparar', help='JSON de uma execução anterior para comparação')
+    parser.add_argument('--limite-regressao', type=float, default=1.2, help='razão de tempo considerada regressão')
+    args = parser.parse_args()
+
+    resultado = executar_benchmark([float(e) if '.' in e else int(e) for e in args.escalas.split(',')], args.repeticoes)
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados gravados em {args.saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            regressoes = comparar(resultado, json.load(f), args.limite_regressao)
+        if regressoes:
+            raise SystemExit(f"{len(regressoes)} etapa(s) com regressão acima de {args.limite_regressao}x")
@@ -1,79 +1,180 @@
+import json
+import sys
+import tracemalloc
+
 import streamlit as st
 import pandas as pd
 from funcoes import *
 
-# Configurações da página
-st.set_page_config(layout="wide", page_title="Análise Portuária 2024")
+# Porto e ano analisados; com a base particionada (python particionar.py) só as
+# partições deles são lidas, senão os dados vêm das planilhas
+PORTO = "salvador"
+ANO = 2024
+DIR_BASE = "dados"
+
+# Pacote de views materializadas (python materializar.py); quando existe, o painel
+# usa só ele, mapeado em memória, sem ler planilhas nem recalcular agregações
+DIR_PACOTE = "pacote_views"
+
+# Fontes de dados carregadas na inicialização, em paralelo: {nome: (loader, *args)}
+FONTES = {
+    "navios": (carregar_navios_base, "dados_2024_wilson.xlsx", DIR_BASE, PORTO, ANO, True),
+    "comex": (carregar_comex_base, "dados_comex.xlsx", DIR_BASE, ANO),
+}
 
 # Cache para carregar os dados
-@st.cache_data
+# cache_resource: todas as sessões compartilham os mesmos DataFrames (somente leitura)
+@st.cache_resource
+def carregar_pacote():
+    return abrir_pacote_views(DIR_PACOTE)
+
+@st.cache_resource
+def carregar_fontes_cache():
+    return carregar_fontes(FONTES)
+
+def erros_fontes():
+    return {} if carregar_pacote() is not None else carregar_fontes_cache()[1]
+
+def erro_fonte(nome):
+    return erros_fontes().get(nome)
+
+# Navios já com as colunas derivadas das hipóteses
+@st.cache_resource
 def carregar_dados():
-    return load_data("dados_2024_wilson.xlsx")
+    pacote = carregar_pacote()
+    if pacote is not None:
+        return pacote["navios"]
+    dados, erros = carregar_fontes_cache()
+    if "navios" not in dados:
+        return None
+    return processar_dados_navios_hipoteses(dados["navios"][0])
+
+# Linhas da planilha de navios rejeitadas por datas inválidas
+def carregar_quarentena_navios():
+    pacote = carregar_pacote()
+    if pacote is not None:
+        return pacote.get("navios_quarentena")
+    navios = carregar_fontes_cache()[0].get("navios")
+    return navios[1] if navios is not None else None
+
+@st.cache_resource
+def carregar_cubo_mensal():
+    pacote = carregar_pacote()
+    return pacote["cubo_mensal"] if pacote is not None else calcular_cubo_mensal(carregar_dados())
 
 @st.cache_data
-def carregar_dados_comex_cache():
-    try:
-        return carregar_dados_comex("dados_comex.xlsx")  # Ajuste o nome do arquivo
-    except:
-        return None
-    
-# Carregar os dados
-df = carregar_dados()
-df_comex = carregar_dados_comex_cache()
-df = processar_dados_navios_hipoteses(df)
+def carregar_versao_navios():
+    pacote = carregar_pacote()
+    return pacote["manifest"]["versoes"]["navios"] if pacote is not None else impressao_digital(carregar_dados())
 
-# Lista dos tópicos
-topicos = ["Introdução", "Hipóteses", "Conclusão"]
+@st.cache_data
+def carregar_testes_hipoteses():
+    return avaliar_hipoteses(carregar_cubo_mensal())
 
-# Menu lateral para selecionar o tópico
-escolha = st.sidebar.radio("Navegue pelos tópicos:", topicos)
+@st.cache_resource
+def carregar_indice_navios():
+    return indexar_navios(carregar_dados())
 
-# Conteúdo que muda conforme a escolha
-if escolha == "Introdução":
-    st.title("Olá, seja bem-vindo à nossa análise")
-    st.header("Introdução")
-    st.write("""
-    Este painel apresenta uma análise detalhada das operações no Porto de Salvador ao longo do ano de 2024. 
-    Foram avaliadas variáveis como o tempo de estadia dos navios, tempo de operação e o volume de movimentações (Movs). 
-    Buscamos compreender padrões, correlações e desvios operacionais, especialmente a partir do mês de outubro, onde foram 
-    identificadas anomalias nos tempos de estadia e operação dos navios.
-    
-    Utilizamos gráficos para facilitar a visualização das hipóteses e aplicar técnicas de tratamento de outliers para refinar a análise. 
-    O objetivo principal é entender quais fatores contribuíram para gargalos e ineficiências na operação portuária no final do ano.
-    """)
+@st.cache_resource
+def carregar_resumo_ocupacao():
+    pacote = carregar_pacote()
+    if pacote is not None:
+        return pacote["resumo_ocupacao"]
+    return resumo_ocupacao_mensal(calcular_ocupacao(carregar_dados()))
 
-elif escolha == "Hipóteses":
-    st.title("Hipóteses")
+# Com o pacote não há DataFrame do Comex: os gráficos usam só os rollups
+def carregar_dados_comex_cache():
+    if carregar_pacote() is not None:
+        return None
+    return carregar_fontes_cache()[0].get("comex")
+
+@st.cache_resource
+def carregar_rollups_comex():
+    pacote = carregar_pacote()
+    if pacote is not None:
+        return rollups_do_pacote(pacote)
+    df_comex = carregar_dados_comex_cache()
+    return calcular_rollups_comex(df_comex, ANO) if df_comex is not None else None
 
+@st.cache_data
+def carregar_versao_comex():
+    pacote = carregar_pacote()
+    if pacote is not None:
+        return pacote["manifest"]["versoes"]["comex"]
+    df_comex = carregar_dados_comex_cache()
+    return impressao_digital(df_comex) if df_comex is not None else None
+
+def mostrar_grafico(fig):
+    with etapa('st.plotly_chart'):
+        st.plotly_chart(fig, use_container_width=True)
+
+def mostrar_teste_hipotese(nome):
+    testes, mudanca = carregar_testes_hipoteses()
+    teste = testes.loc[nome]
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Pearson", f"{teste['Pearson']:.2f}")
+    col2.metric("Spearman", f"{teste['Spearman']:.2f}")
+    col3.metric("IC 95% (bootstrap)", f"{teste['IC inferior']:.2f} a {teste['IC superior']:.2f}")
+    if mudanca is not None:
+        col4.metric(
+            f"Pearson antes/depois de {mudanca['periodo'].strftime('%m/%Y')}",
+            f"{teste['Pearson antes da mudança']:.2f} / {teste['Pearson depois da mudança']:.2f}",
+        )
+
+def aviso_comex_indisponivel():
+    st.warning(f"Dados de comércio exterior indisponíveis ({erro_fonte('comex')}).")
+
+def dados_comex():
+    return carregar_dados_comex_cache(), carregar_rollups_comex(), carregar_versao_comex()
+
+def avisar_erros_fontes():
+    erros = erros_fontes()
+    for nome, erro in erros.items():
+        st.sidebar.error(f"Falha ao carregar a fonte '{nome}': {erro}")
+    if erros and st.sidebar.button("Tentar carregar novamente"):
+        st.cache_resource.clear()
+        st.cache_data.clear()
+        st.rerun()
+
+# Cada hipótese é montada só quando selecionada
+def secao_hipotese_1():
     st.header("1° Hipótese:")
     st.write("O tempo de permanência dos navios no porto (desde a chegada na barra até a desatracação) está diretamente correlacionado com o volume de movimentação (Movs). Navios com mais Movs permanecem por um tempo proporcionalmente maior?")
 
     # Gráfico hipóteses
-    fig_hip = grafico_hipoteses(df)
-    st.plotly_chart(fig_hip, use_container_width=True)
+    fig_hip = figura_em_cache(grafico_hipoteses, df, cubo, versao=versao_navios)
+    mostrar_grafico(fig_hip)
+    mostrar_teste_hipotese("Movs x Tempo de Estadia")
 
     st.write("Analisando o gráfico acima, constata-se que esta hipótese é verdadeira, visto que o tempo de permanência dos navios no porto em relação à quantidade total de Movs do mês não varia muito até o mês 10/2024 (Outubro), e assim segue até 12/2024 (Dezembro), onde há um aumento muito grande no tempo de permanência sem o mesmo aumento na quantidade de Movs.")
 
+def secao_hipotese_2():
     st.header("2° Hipótese:")
     st.write("O Tempo de Operação está diretamente correlacionado com o volume de movimentações?")
 
     # Reutilizar gráfico de horas x movs
-    fig_hip2 = grafico_horasxmovs_mes(df)
-    st.plotly_chart(fig_hip2, use_container_width=True)
+    fig_hip2 = figura_em_cache(grafico_horasxmovs_mes, df, cubo, versao=versao_navios)
+    mostrar_grafico(fig_hip2)
+    mostrar_teste_hipotese("Movs x Tempo de Operação")
 
     st.write("Analisando o gráfico acima, vemos que há uma correlação entre o Tempo de Operação e a quantidade de Movs, com pequenos desvios entre os meses. No entanto, a partir do mês 10 até o mês 12 temos um desvio bastante significativo, saindo do aceitável.")
 
+def secao_hipotese_3():
     st.header("3° Hipótese: ")
     st.write("O que acontece a partir do mês 10?")
 
     st.write("Primeiro iremos analisar por outro ângulo, verificando a média entre a diferença de Tempo Estadia no Porto e Tempo de Operação.")
 
     # Gráfico diferença porto operação
-    fig_dif = grafico_dif_porto_operacao(df)
-    st.plotly_chart(fig_dif, use_container_width=True)
+    fig_dif = figura_em_cache(grafico_dif_porto_operacao, df, cubo, versao=versao_navios)
+    mostrar_grafico(fig_dif)
 
     st.write("Verifica-se que a diferença entre os meses 01/2024 e 09/2024 está entre 7 e 17 horas de atraso. Porém, a partir do mês 10 o atraso sobe consideravelmente.")
 
+    mudanca = carregar_testes_hipoteses()[1]
+    if mudanca is not None:
+        st.write(f"A detecção de ponto de mudança na série mensal confirma o salto: a partir de `{mudanca['periodo'].strftime('%m/%Y')}` a diferença média passa de `{mudanca['media_antes']:.1f}` para `{mudanca['media_depois']:.1f}` horas, um corte que explica `{mudanca['variancia_explicada']:.0%}` da variância entre os meses.")
+
     # Causas externas adicionais
     st.subheader("Possíveis causas externas para o aumento de atraso no Porto de Salvador:")
     st.write("""
@@ -81,70 +182,218 @@ elif escolha == "Hipóteses":
     - Congestionamento no Porto de Santos, o principal do país, que gerou um desvio logístico de cargas para o Porto de Salvador, aumentando o fluxo e a demanda local de forma atípica.
     """)
 
+    # Ocupação dos berços ao longo do tempo
+    st.subheader("Ocupação dos berços")
+    st.write("Para entender o congestionamento, o gráfico abaixo mostra, dia a dia, quantos navios estavam atracados ao mesmo tempo, quantos estavam em operação e quantos estavam parados no berço.")
+
+    fig_ocupacao = figura_em_cache(grafico_ocupacao, df, versao=versao_navios)
+    mostrar_grafico(fig_ocupacao)
+
+    media_atracados = carregar_resumo_ocupacao()[('Navios Atracados', 'mean')]
+    antes_outubro = media_atracados[media_atracados.index.month < 10].mean()
+    depois_outubro = media_atracados[media_atracados.index.month >= 10].mean()
+    st.write(f"Em média, havia `{antes_outubro:.2f}` navios atracados ao mesmo tempo entre janeiro e setembro, contra `{depois_outubro:.2f}` de outubro em diante.")
+
+def secao_hipotese_4():
+    df_comex, rollups_comex, versao_comex = dados_comex()
+
     st.header("4° Hipótese: Sazonalidade")
     st.write("Existe um padrão de sazonalidade nas operações do porto ao longo do ano de 2024?")
 
     col1, col2 = st.columns(2)
     with col1:
         st.markdown("**Movimentações por mês (Movs)**")
-        fig_sazonal1 = grafico_sazonalidade_movs(df)
-        st.plotly_chart(fig_sazonal1, use_container_width=True)
+        fig_sazonal1 = figura_em_cache(grafico_sazonalidade_movs, df, versao=versao_navios, parametros={'ano': ANO})
+        mostrar_grafico(fig_sazonal1)
 
     with col2:
         st.markdown("**Exportações + Importações por mês (kg)**")
-        fig_sazonal2 = grafico_sazonalidade_comex(df_comex)
-        st.plotly_chart(fig_sazonal2, use_container_width=True)
+        if rollups_comex is None:
+            aviso_comex_indisponivel()
+        else:
+            fig_sazonal2 = figura_em_cache(grafico_sazonalidade_comex, df_comex, rollups_comex, versao=versao_comex)
+            mostrar_grafico(fig_sazonal2)
 
     st.write("A análise mostra que há uma variação significativa nos volumes ao longo dos meses, indicando certa sazonalidade. Essa oscilação pode estar relacionada a fatores como calendário agrícola, demanda internacional e sazonalidade de mercado.")
 
+def secao_hipotese_5():
     st.header("5° Hipótese: Eficiência Operacional por Serviço")
     st.write("Alguns serviços são mais eficientes em termos operacionais do que outros?")
 
-    fig_eficiencia = grafico_eficiencia_servico(df)
-    st.plotly_chart(fig_eficiencia, use_container_width=True)
+    # Filtros respondidos pelos índices (bitmaps) dos navios, sem varrer nem copiar o DataFrame
+    indice = carregar_indice_navios()
+    meses_disponiveis = list(indice['valores']['Mês'])
+    col_meses, col_servicos = st.columns(2)
+    meses = col_meses.multiselect("Meses", meses_disponiveis, format_func=lambda mes: mes.strftime('%m/%Y'))
+    servicos = col_servicos.multiselect("Serviços", list(indice['valores']['Serviço']))
+    filtros = {'meses': tuple(meses) or None, 'servicos': tuple(servicos) or None}
+
+    resumo = agregar_navios(indice, filtrar_navios(indice, **filtros))
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Navios", resumo['navios'])
+    col2.metric("Movs/h médio", f"{resumo['movs_h']:.1f}" if resumo['navios'] else "-")
+    col3.metric("Estadia média (h)", f"{resumo['estadia_h']:.1f}" if resumo['navios'] else "-")
+    col4.metric("Tempo não operacional médio (h)", f"{resumo['nao_operacional_h']:.1f}" if resumo['navios'] else "-")
+
+    excluidas = resumo_flags_operacao(df)
+    if excluidas.any():
+        st.caption("Fora das médias de Movs/h: " + ", ".join(f"{motivo.lower()} ({total})" for motivo, total in excluidas.items() if total))
+
+    if resumo['navios'] == 0:
+        st.info("Nenhum navio atende aos filtros selecionados.")
+    else:
+        fig_eficiencia = figura_em_cache(grafico_eficiencia_servico, df, indice, versao=versao_navios, parametros=filtros)
+        mostrar_grafico(fig_eficiencia)
 
     st.write("Através do gráfico, é possível observar diferenças significativas na eficiência entre os tipos de serviço. Isso pode auxiliar na tomada de decisões estratégicas sobre alocação de recursos ou melhorias operacionais específicas.")
 
+def secao_hipotese_6():
+    df_comex, rollups_comex, versao_comex = dados_comex()
+
     st.header("6° Hipótese: Exportações por Município")
     st.write("As exportações estão concentradas em determinados municípios?")
+    if rollups_comex is None:
+        aviso_comex_indisponivel()
+        return
 
-    fig_municipios = grafico_produtos_municipio(df_comex)
-    st.plotly_chart(fig_municipios, use_container_width=True)
+    fig_municipios = figura_em_cache(grafico_produtos_municipio, df_comex, rollups_comex, versao=versao_comex)
+    mostrar_grafico(fig_municipios)
 
     st.write("A análise mostra uma concentração das exportações em poucos municípios, refletindo a vocação produtiva regional e as cadeias logísticas ligadas ao porto. Com isso, é possível pensar em estratégias logísticas específicas para os principais polos exportadores.")
 
+def secao_hipotese_7():
+    df_comex, rollups_comex, versao_comex = dados_comex()
+
     st.header("7° Hipótese: Concentração das Exportações por País")
     st.write("Existe concentração das exportações em poucos países de destino?")
+    if rollups_comex is None:
+        aviso_comex_indisponivel()
+        return
 
-    fig_paises, top3_pct = grafico_concentracao_pais(df_comex)
-    st.plotly_chart(fig_paises, use_container_width=True)
+    fig_paises, top3_pct = figura_em_cache(grafico_concentracao_pais, df_comex, rollups_comex, versao=versao_comex)
+    mostrar_grafico(fig_paises)
 
     st.write(f"A análise revela que os três principais países de destino concentram cerca de `{top3_pct:.2f}%` das exportações totais. Isso evidencia uma dependência comercial relevante com poucos parceiros, o que pode representar riscos ou oportunidades comerciais.")
 
+def secao_hipotese_8():
+    df_comex, rollups_comex, versao_comex = dados_comex()
+
     st.header("8° Hipótese: Valor FOB por Kg")
     st.write("Quais produtos apresentam maior valor FOB (Free on Board) por quilo exportado?")
+    if rollups_comex is None:
+        aviso_comex_indisponivel()
+        return
 
-    fig_valor_fob = grafico_valor_fob_kg(df_comex)
-    st.plotly_chart(fig_valor_fob, use_container_width=True)
+    fig_valor_fob = figura_em_cache(grafico_valor_fob_kg, df_comex, rollups_comex, versao=versao_comex)
+    mostrar_grafico(fig_valor_fob)
 
     st.write("Os produtos com maior valor FOB por quilo são, em sua maioria, bens de alto valor agregado e menor volume. Essa análise é essencial para estratégias de rentabilidade logística, pois permite priorizar cargas com melhor relação valor/peso.")
 
-        
-elif escolha == "Conclusão":
-    st.title("Conclusão")
-    st.write("""
-    A análise realizada sobre os dados do Porto de Salvador em 2024 revelou padrões consistentes de correlação entre o volume de movimentações e o tempo de operação dos navios, confirmando as hipóteses iniciais para a maior parte do ano.
-
-    Entretanto, a partir de outubro observamos um aumento expressivo nos tempos de estadia, sem correspondente aumento nos Movs. Essa discrepância pode ser atribuída a fatores externos identificados, como a greve da Receita Federal iniciada em 17/10/2024 e o desvio de cargas do Porto de Santos, que enfrentava congestionamento.
+SECOES_HIPOTESES = {
+    "1° Hipótese": secao_hipotese_1,
+    "2° Hipótese": secao_hipotese_2,
+    "3° Hipótese": secao_hipotese_3,
+    "4° Hipótese: Sazonalidade": secao_hipotese_4,
+    "5° Hipótese: Eficiência Operacional por Serviço": secao_hipotese_5,
+    "6° Hipótese: Exportações por Município": secao_hipotese_6,
+    "7° Hipótese: Concentração das Exportações por País": secao_hipotese_7,
+    "8° Hipótese: Valor FOB por Kg": secao_hipotese_8,
+}
 
-    Essas anomalias reforçam a importância de análises contínuas e de considerar o contexto operacional externo. Além disso, técnicas de limpeza e tratamento de dados mostraram-se fundamentais para obter uma visão mais precisa da situação.
-
-    Por fim, destacamos a necessidade de melhorias na infraestrutura logística e maior resiliência do sistema portuário a eventos inesperados, como greves ou mudanças repentinas no fluxo de cargas.
-    """)
+# Lista dos tópicos
+topicos = ["Introdução", "Hipóteses", "Conclusão"]
 
-# Sidebar com informações adicionais
-st.sidebar.markdown("---")
-st.sidebar.markdown("### Informações")
-st.sidebar.info("Dashboard de análise portuária desenvolvido com Streamlit")
-st.sidebar.markdown(f"**Total de registros:** {len(df)}")
-st.sidebar.markdown(f"**Período:** {df['Mês'].min()} a {df['Mês'].max()}")
+# Os loaders de carregar_fontes rodam em processos spawn, que importam este
+# script como __mp_main__: o painel só é montado no processo do Streamlit
+if __name__ == "__main__":
+    # Configurações da página
+    st.set_page_config(layout="wide", page_title="Análise Portuária 2024")
+
+    # Spans de tempo/memória deste rerun (exibidos no painel de depuração). O
+    # tracemalloc vale para o servidor inteiro, então só é ligado na inicialização:
+    # streamlit run dash.py -- --medir-memoria
+    if "--medir-memoria" in sys.argv and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    iniciar_coleta_etapas()
+
+    # Carregar os dados (as duas fontes em paralelo; as pré-agregações do comércio
+    # exterior só quando uma seção precisa delas)
+    df = carregar_dados()
+    avisar_erros_fontes()
+    if df is None:
+        st.error("Os dados dos navios não puderam ser carregados; o painel depende deles.")
+        st.stop()
+    cubo = carregar_cubo_mensal()
+    versao_navios = carregar_versao_navios()
+
+    # Menu lateral para selecionar o tópico
+    escolha = st.sidebar.radio("Navegue pelos tópicos:", topicos)
+
+    # Conteúdo que muda conforme a escolha
+    if escolha == "Introdução":
+        st.title("Olá, seja bem-vindo à nossa análise")
+        st.header("Introdução")
+        st.write("""
+        Este painel apresenta uma análise detalhada das operações no Porto de Salvador ao longo do ano de 2024. 
+        Foram avaliadas variáveis como o tempo de estadia dos navios, tempo de operação e o volume de movimentações (Movs). 
+        Buscamos compreender padrões, correlações e desvios operacionais, especialmente a partir do mês de outubro, onde foram 
+        identificadas anomalias nos tempos de estadia e operação dos navios.
+
+        Utilizamos gráficos para facilitar a visualização das hipóteses e aplicar técnicas de tratamento de outliers para refinar a análise. 
+        O objetivo principal é entender quais fatores contribuíram para gargalos e ineficiências na operação portuária no final do ano.
+        """)
+
+    elif escolha == "Hipóteses":
+        st.title("Hipóteses")
+
+        secao = st.radio("Escolha a hipótese:", list(SECOES_HIPOTESES), horizontal=True)
+        SECOES_HIPOTESES[secao]()
+
+    elif escolha == "Conclusão":
+        st.title("Conclusão")
+        st.write("""
+        A análise realizada sobre os dados do Porto de Salvador em 2024 revelou padrões consistentes de correlação entre o volume de movimentações e o tempo de operação dos navios, confirmando as hipóteses iniciais para a maior parte do ano.
+
+        Entretanto, a partir de outubro observamos um aumento expressivo nos tempos de estadia, sem correspondente aumento nos Movs. Essa discrepância pode ser atribuída a fatores externos identificados, como a greve da Receita Federal iniciada em 17/10/2024 e o desvio de cargas do Porto de Santos, que enfrentava congestionamento.
+
+        Essas anomalias reforçam a importância de análises contínuas e de considerar o contexto operacional externo. Além disso, técnicas de limpeza e tratamento de dados mostraram-se fundamentais para obter uma visão mais precisa da situação.
+
+        Por fim, destacamos a necessidade de melhorias na infraestrutura logística e maior resiliência do sistema portuário a eventos inesperados, como greves ou mudanças repentinas no fluxo de cargas.
+        """)
+
+    # Sidebar com informações adicionais
+    st.sidebar.markdown("---")
+    st.sidebar.markdown("### Informações")
+    st.sidebar.info("Dashboard de análise portuária desenvolvido com Streamlit")
+    st.sidebar.markdown(f"**Total de registros:** {len(df)}")
+    st.sidebar.markdown(f"**Período:** {df['Mês'].min().strftime('%m/%Y')} a {df['Mês'].max().strftime('%m/%Y')}")
+    quarentena = carregar_quarentena_navios()
+    if quarentena is not None and len(quarentena):
+        st.sidebar.warning(f"{len(quarentena)} linha(s) da planilha de navios em quarentena por datas inválidas")
+        with st.sidebar.expander("Ver linhas em quarentena"):
+            st.dataframe(quarentena, hide_index=True)
+    if carregar_pacote() is not None:
+        st.sidebar.caption(f"Pacote de views: {carregar_pacote()['manifest']['versao']}")
+    cache_figuras = estatisticas_cache_figuras()
+    st.sidebar.caption(f"Cache de gráficos: {cache_figuras['acertos']} acertos, {cache_figuras['falhas']} falhas")
+
+    # Painel de depuração: tempo (e memória) de cada etapa deste rerun
+    if st.sidebar.checkbox("Painel de depuração"):
+        if not tracemalloc.is_tracing():
+            st.sidebar.caption("Memória não medida (inicie com: streamlit run dash.py -- --medir-memoria).")
+
+        spans = etapas_coletadas()
+        if spans:
+            df_spans = pd.DataFrame(spans).sort_values('inicio_ms')
+            df_spans['etapa'] = ['  ' * p + n for p, n in zip(df_spans['profundidade'], df_spans['nome'])]
+            colunas_spans = ['etapa', 'duracao_ms'] + (['pico_memoria_mb'] if 'pico_memoria_mb' in df_spans else [])
+            st.sidebar.dataframe(df_spans[colunas_spans].round(2), hide_index=True)
+            st.sidebar.caption(f"Total medido no nível superior: {df_spans.loc[df_spans['profundidade'] == 0, 'duracao_ms'].sum():.1f} ms")
+        else:
+            st.sidebar.caption("Nenhuma etapa executada neste rerun (tudo veio do cache).")
+        st.sidebar.download_button(
+            "Baixar trace",
+            data=json.dumps(montar_trace(spans), ensure_ascii=False),
+            file_name="trace_dashboard.json",
+            mime="application/json",
+        )
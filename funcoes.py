@@ -1,18 +1,332 @@
+import functools
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime
+
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
 
-def load_data(path):
-    """Carrega e processa os dados do arquivo Excel"""
-    df = pd.read_excel(path)
+# Spans de tempo/memória coletados por thread (cada sessão do Streamlit roda na sua)
+_COLETA_ETAPAS = threading.local()
+
+# O tracemalloc é do processo inteiro: conta as threads com span aberto para
+# descartar a memória de spans que se sobrepuseram a outra sessão
+_MEMORIA_SPANS = {'threads_ativas': 0, 'sobreposicoes': 0}
+_TRAVA_MEMORIA_SPANS = threading.Lock()
+
+def iniciar_coleta_etapas():
+    """Começa uma nova coleta de spans na thread atual (ex.: a cada rerun do dashboard)"""
+    _COLETA_ETAPAS.spans = []
+    _COLETA_ETAPAS.pilha = []
+    _COLETA_ETAPAS.inicio = time.perf_counter()
+
+def etapas_coletadas():
+    """Retorna os spans coletados na thread atual desde iniciar_coleta_etapas"""
+    return list(getattr(_COLETA_ETAPAS, 'spans', None) or [])
+
+@contextmanager
+def etapa(nome, **atributos):
+    """Mede tempo (e memória, se o tracemalloc estiver ativo) de um trecho como um span"""
+    spans = getattr(_COLETA_ETAPAS, 'spans', None)
+    if spans is None:
+        yield
+        return
+
+    pilha = _COLETA_ETAPAS.pilha
+    medir_memoria = tracemalloc.is_tracing()
+    atual = {'pico': 0}
+    if medir_memoria:
+        with _TRAVA_MEMORIA_SPANS:
+            if not pilha:
+                if _MEMORIA_SPANS['threads_ativas']:
+                    _MEMORIA_SPANS['sobreposicoes'] += 1
+                _MEMORIA_SPANS['threads_ativas'] += 1
+            atual['exclusivo'] = _MEMORIA_SPANS['threads_ativas'] == 1
+            atual['sobreposicoes'] = _MEMORIA_SPANS['sobreposicoes']
+        # O pico do tracemalloc é global: guarda o do span pai antes de zerar para este
+        if pilha:
+            pilha[-1]['pico'] = max(pilha[-1]['pico'], tracemalloc.get_traced_memory()[1])
+        atual['memoria_inicial'] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    pilha.append(atual)
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        fim = time.perf_counter()
+        pilha.pop()
+        span = {
+            'nome': nome,
+            'inicio_ms': (inicio - _COLETA_ETAPAS.inicio) * 1000,
+            'duracao_ms': (fim - inicio) * 1000,
+            'profundidade': len(pilha),
+            'thread': threading.get_ident(),
+            **atributos,
+        }
+        if medir_memoria:
+            with _TRAVA_MEMORIA_SPANS:
+                exclusivo = atual['exclusivo'] and atual['sobreposicoes'] == _MEMORIA_SPANS['sobreposicoes']
+                if not pilha:
+                    _MEMORIA_SPANS['threads_ativas'] -= 1
+            # Com outra sessão medindo ao mesmo tempo, o pico misturaria as duas
+            if exclusivo and tracemalloc.is_tracing():
+                pico = max(atual['pico'], tracemalloc.get_traced_memory()[1])
+                span['pico_memoria_mb'] = (pico - atual['memoria_inicial']) / 1e6
+                if pilha:
+                    pilha[-1]['pico'] = max(pilha[-1]['pico'], pico)
+        spans.append(span)
+
+def instrumentado(funcao):
+    """Decorador que registra cada chamada da função como um span"""
+    @functools.wraps(funcao)
+    def envoltorio(*args, **kwargs):
+        if getattr(_COLETA_ETAPAS, 'spans', None) is None:
+            return funcao(*args, **kwargs)
+        with etapa(funcao.__name__):
+            return funcao(*args, **kwargs)
+    return envoltorio
+
+def montar_trace(spans):
+    """Converte os spans para o formato Trace Event (chrome://tracing ou Perfetto)"""
+    eventos = [{
+        'name': span['nome'],
+        'ph': 'X',
+        'ts': span['inicio_ms'] * 1000,
+        'dur': span['duracao_ms'] * 1000,
+        'pid': os.getpid(),
+        'tid': span['thread'],
+        'args': {chave: valor for chave, valor in span.items()
+                 if chave not in ('nome', 'inicio_ms', 'duracao_ms', 'thread')},
+    } for span in spans]
+    return {'traceEvents': eventos, 'displayTimeUnit': 'ms'}
+
+def exportar_trace(spans, path):
+    """Grava os spans em um arquivo de trace"""
+    with open(path, 'w', encoding='utf-8') as arquivo:
+        json.dump(montar_trace(spans), arquivo, ensure_ascii=False)
+
+# Versão do formato do cache; incrementar quando o processamento dos loaders mudar
+VERSAO_CACHE = 4
+
+def _chave_cache(path):
+    """Gera a chave do cache a partir do hash e do mtime do arquivo de origem"""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as arquivo:
+        for bloco in iter(lambda: arquivo.read(1 << 20), b''):
+            sha.update(bloco)
+    mtime = os.stat(path).st_mtime_ns
+    return f"v{VERSAO_CACHE}-{sha.hexdigest()[:16]}-{mtime}"
+
+def _caminho_cache(path, tipo, dir_cache=None):
+    """Retorna o diretório e o prefixo dos arquivos de cache de uma origem"""
+    if dir_cache is None:
+        dir_cache = os.path.join(os.path.dirname(os.path.abspath(path)), '.cache')
+    prefixo = f"{os.path.basename(path)}.{tipo}."
+    return dir_cache, prefixo
+
+@instrumentado
+def ler_cache(path, tipo, dir_cache=None):
+    """Lê o cache colunar (Parquet, via memory-map) se ainda for válido para o arquivo"""
+    dir_cache, prefixo = _caminho_cache(path, tipo, dir_cache)
+    arquivo_cache = os.path.join(dir_cache, f"{prefixo}{_chave_cache(path)}.parquet")
+    if not os.path.exists(arquivo_cache):
+        return None
+    try:
+        return pd.read_parquet(arquivo_cache, memory_map=True)
+    except Exception:
+        return None
+
+def _tipos_arrow(df):
+    """Cópia rasa de df com as colunas de texto de tipos mistos convertidas em texto
+
+    Colunas assim (ex.: ETB/ETD, datas lidas pelo openpyxl no meio de strings) não
+    têm tipo Arrow. Os loaders já aplicam a conversão no processamento, para a
+    carga sem cache e a lida do Parquet devolverem o mesmo DataFrame.
+    """
+    df_arrow = df.copy(deep=False)
+    for coluna in df_arrow.columns[df_arrow.dtypes == object]:
+        tipos = df_arrow[coluna].dropna().map(type).unique()
+        if len(tipos) > 1:
+            df_arrow[coluna] = df_arrow[coluna].where(df_arrow[coluna].isna(), df_arrow[coluna].astype(str))
+    return df_arrow
+
+@instrumentado
+def gravar_cache(path, tipo, df, dir_cache=None):
+    """Grava o DataFrame processado no cache colunar e remove versões antigas"""
+    dir_cache, prefixo = _caminho_cache(path, tipo, dir_cache)
+    os.makedirs(dir_cache, exist_ok=True)
+    nome = f"{prefixo}{_chave_cache(path)}.parquet"
+
+    temporario = os.path.join(dir_cache, f".{nome}.{os.getpid()}.tmp")
+    _tipos_arrow(df).to_parquet(temporario)
+    os.replace(temporario, os.path.join(dir_cache, nome))
+
+    for antigo in os.listdir(dir_cache):
+        if antigo.startswith(prefixo) and antigo != nome:
+            try:
+                os.remove(os.path.join(dir_cache, antigo))
+            except OSError:
+                pass
+
+# Figuras já geradas (LRU), compartilhadas e tratadas como imutáveis, e contadores de acerto/falha
+_CACHE_FIGURAS = OrderedDict()
+MAX_CACHE_FIGURAS = 128
+_ESTATISTICAS_CACHE_FIGURAS = {'acertos': 0, 'falhas': 0}
+_TRAVA_CACHE_FIGURAS = threading.Lock()
+
+def figura_em_cache(funcao, *dados, versao, parametros=None):
+    """Memoriza o resultado de um gráfico por versão dos dados e parâmetros
+
+    Chama funcao(*dados, **parametros) só na primeira vez; depois devolve o
+    mesmo go.Figure (ou tupla), que o st.plotly_chart serializa sem revalidar.
+    Quem recebe não deve alterar a figura. versao identifica os dados (ex.:
+    impressao_digital).
+    """
+    parametros = parametros or {}
+    chave = (funcao.__module__, funcao.__qualname__, versao, tuple(sorted(parametros.items())))
+    with _TRAVA_CACHE_FIGURAS:
+        resultado = _CACHE_FIGURAS.get(chave)
+        if resultado is not None:
+            _CACHE_FIGURAS.move_to_end(chave)
+            _ESTATISTICAS_CACHE_FIGURAS['acertos'] += 1
+            return resultado
+        _ESTATISTICAS_CACHE_FIGURAS['falhas'] += 1
+
+    resultado = funcao(*dados, **parametros)
+    with _TRAVA_CACHE_FIGURAS:
+        _CACHE_FIGURAS[chave] = resultado
+        while len(_CACHE_FIGURAS) > MAX_CACHE_FIGURAS:
+            _CACHE_FIGURAS.popitem(last=False)
+    return resultado
+
+def estatisticas_cache_figuras():
+    """Retorna acertos, falhas e tamanho atual do cache de figuras"""
+    with _TRAVA_CACHE_FIGURAS:
+        return dict(_ESTATISTICAS_CACHE_FIGURAS, tamanho=len(_CACHE_FIGURAS))
+
+def limpar_cache_figuras():
+    """Esvazia o cache de figuras e zera os contadores"""
+    with _TRAVA_CACHE_FIGURAS:
+        _CACHE_FIGURAS.clear()
+        _ESTATISTICAS_CACHE_FIGURAS.update(acertos=0, falhas=0)
+
+@instrumentado
+def load_data(path, usar_cache=True, quarentena=False, apenas_cache=False):
+    """Carrega e processa os dados do arquivo Excel
+
+    Linhas com datas inválidas não interrompem a carga: vão para a quarentena,
+    devolvida junto (df, quarentena) quando quarentena=True. Com
+    apenas_cache=True retorna None em vez de ler a planilha.
+    """
+    if usar_cache:
+        df = ler_cache(path, 'navios')
+        df_quarentena = ler_cache(path, 'navios-quarentena') if quarentena else None
+        if df is not None and (not quarentena or df_quarentena is not None):
+            return (df, df_quarentena) if quarentena else df
+    if apenas_cache:
+        return None
+
+    with etapa('read_excel'):
+        df = pd.read_excel(path)
+    df, df_quarentena = processar_navios_com_quarentena(df)
+
+    if usar_cache:
+        gravar_cache(path, 'navios', df)
+        gravar_cache(path, 'navios-quarentena', df_quarentena)
+
+    return (df, df_quarentena) if quarentena else df
+
+# Colunas de data convertidas no processamento dos navios e o formato delas quando vêm como texto
+COLUNAS_DATAS_NAVIOS = ['Desatracação', 'Atracação', 'Fim Operação', 'Início Operação']
+FORMATO_DATA_NAVIOS = '%d/%m/%Y %H:%M'
+
+def _converter_valores_data(valores, formato):
+    """Converte um array de valores distintos (datas nativas ou texto) em datetime64; inválidos viram NaT"""
+    convertidos = np.full(len(valores), np.datetime64('NaT'), dtype='datetime64[ns]')
+    nativos = np.fromiter((isinstance(valor, (datetime, date, np.datetime64)) for valor in valores), dtype=bool, count=len(valores))
+    textos = np.fromiter((isinstance(valor, str) for valor in valores), dtype=bool, count=len(valores))
+    if nativos.any():
+        convertidos[nativos] = pd.to_datetime(pd.Series(valores[nativos], dtype=object), errors='coerce').to_numpy()
+    if textos.any():
+        texto = pd.Series(valores[textos], dtype=object).str.strip()
+        datas = pd.to_datetime(texto, format=formato, errors='coerce')
+        # Texto fora do formato da planilha ainda é aceito se estiver em ISO 8601 (ex.: exportações do openpyxl)
+        faltando = datas.isna()
+        if faltando.any():
+            datas[faltando] = pd.to_datetime(texto[faltando], format='ISO8601', errors='coerce')
+        convertidos[textos] = datas.to_numpy()
+    return convertidos
+
+@instrumentado
+def converter_datas(df, colunas=COLUNAS_DATAS_NAVIOS, formato=FORMATO_DATA_NAVIOS):
+    """Converte várias colunas de data em uma única etapa
 
-    # Converter colunas para datetime
-    df['Desatracação'] = pd.to_datetime(df['Desatracação'], format='%d/%m/%Y %H:%M')
-    df['Atracação'] = pd.to_datetime(df['Atracação'], format='%d/%m/%Y %H:%M')
-    df['Fim Operação'] = pd.to_datetime(df['Fim Operação'], format='%d/%m/%Y %H:%M')
-    df['Início Operação'] = pd.to_datetime(df['Início Operação'], format='%d/%m/%Y %H:%M')
+    Colunas que já vêm como datetime64 (o caso do openpyxl) passam direto. As
+    demais são empilhadas e cada valor distinto é interpretado uma única vez.
+    Retorna as colunas convertidas e um DataFrame booleano que marca as células
+    preenchidas que não puderam ser convertidas (texto vazio conta como em branco).
+    """
+    convertidas = {}
+    invalidas = pd.DataFrame(False, index=df.index, columns=colunas)
+    pendentes = []
+    for coluna in colunas:
+        if pd.api.types.is_datetime64_dtype(df[coluna]):
+            convertidas[coluna] = df[coluna]
+        else:
+            pendentes.append(coluna)
 
+    if pendentes:
+        empilhados = np.concatenate([df[coluna].to_numpy(dtype=object) for coluna in pendentes])
+        codigos, distintos = pd.factorize(empilhados)
+        distintos = np.asarray(distintos, dtype=object)
+        datas = _converter_valores_data(distintos, formato)
+        datas = np.where(codigos >= 0, datas[codigos], np.datetime64('NaT'))
+        # Texto vazio (ou só espaços) é célula em branco, como NaN: vira NaT sem ir para a quarentena
+        vazios = np.fromiter((isinstance(valor, str) and not valor.strip() for valor in distintos), dtype=bool, count=len(distintos))
+        preenchidos = (codigos >= 0) & ~vazios[np.maximum(codigos, 0)]
+        invalidos = preenchidos & np.isnat(datas)
+        for i, coluna in enumerate(pendentes):
+            trecho = slice(i * len(df), (i + 1) * len(df))
+            convertidas[coluna] = pd.Series(datas[trecho], index=df.index, name=coluna)
+            invalidas[coluna] = invalidos[trecho]
+    return convertidas, invalidas
+
+@instrumentado
+def processar_navios_com_quarentena(df):
+    """Processa os navios como _processar_navios e separa as linhas com datas inválidas
+
+    Retorna (df processado, quarentena). A quarentena traz as linhas brutas
+    rejeitadas e a coluna 'Motivo quarentena' com as colunas de data inválidas.
+    """
+    convertidas, invalidas = converter_datas(df)
+    rejeitadas = invalidas.any(axis=1).to_numpy()
+    quarentena = df[rejeitadas].copy()
+    quarentena['Motivo quarentena'] = [
+        'data inválida: ' + ', '.join(invalidas.columns[linha]) for linha in invalidas.to_numpy()[rejeitadas]
+    ]
+
+    for coluna, valores in convertidas.items():
+        df[coluna] = valores
+    if rejeitadas.any():
+        df = df[~rejeitadas].copy()
+    return _tipos_arrow(_calcular_tempos_navios(df)), _tipos_arrow(quarentena)
+
+def _calcular_tempos_navios(df):
+    """Calcula os tempos em horas e remove navios sem Movs (datas já convertidas)"""
     # Calcular tempos
     df['Tempo no porto'] = df['Desatracação'] - df['Atracação']
     df['Tempo de Operação'] = df['Fim Operação'] - df['Início Operação']
@@ -24,25 +338,465 @@ def load_data(path):
 
     # Criar colunas 'Dia' e 'Mês'
     df['Dia'] = df['Atracação'].dt.date
-    df['Mês'] = df['Atracação'].dt.strftime('%m/%Y')
+    df['Mês'] = df['Atracação'].dt.to_period('M')
 
     return df
 
+@instrumentado
+def _processar_navios(df):
+    """Converte datas, calcula os tempos em horas e remove navios sem Movs (e linhas com datas inválidas)"""
+    return processar_navios_com_quarentena(df)[0]
+
+def rotulos_mes(meses):
+    """Formata períodos mensais como 'mm/aaaa' (só para as linhas exibidas)"""
+    return pd.PeriodIndex(meses, freq='M').strftime('%m/%Y')
+
+# Colunas mantidas pelo carregamento em blocos (as usadas pelo dashboard)
+COLUNAS_NAVIOS_COMPACTO = [
+    'Serviço', 'Movs', 'Chegada na Barra', 'Atracação', 'Início Operação', 'Fim Operação',
+    'Desatracação', 'Tempo no porto H', 'Tempo de Operação H', 'Tempo Estadia Porto',
+    'Diferença Porto x Operação', 'Dia', 'Mês',
+]
+
+def _nomes_colunas(cabecalho):
+    """Replica os nomes de coluna do pd.read_excel (Unnamed: i e sufixos .1, .2 em duplicadas)"""
+    nomes, vistos = [], {}
+    for i, nome in enumerate(cabecalho):
+        nome = f"Unnamed: {i}" if nome is None else str(nome)
+        if nome in vistos:
+            vistos[nome] += 1
+            nome = f"{nome}.{vistos[nome]}"
+        else:
+            vistos[nome] = 0
+        nomes.append(nome)
+    return nomes
+
+def ler_excel_em_blocos(path, tamanho_bloco=5000):
+    """Gera DataFrames com blocos de linhas da primeira planilha, sem carregar a planilha inteira"""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        linhas = wb.worksheets[0].iter_rows(values_only=True)
+        colunas = _nomes_colunas(next(linhas, ()))
+        bloco = []
+        for linha in linhas:
+            bloco.append(linha)
+            if len(bloco) >= tamanho_bloco:
+                yield pd.DataFrame.from_records(bloco, columns=colunas)
+                bloco = []
+        if bloco:
+            yield pd.DataFrame.from_records(bloco, columns=colunas)
+    finally:
+        wb.close()
+
+def _compactar_navios(df, colunas):
+    """Mantém só as colunas pedidas e reduz os tipos numéricos"""
+    df = df[[coluna for coluna in colunas if coluna in df.columns]]
+    tipos = {}
+    for coluna in df.columns:
+        if pd.api.types.is_integer_dtype(df[coluna]):
+            tipos[coluna] = pd.to_numeric(df[coluna], downcast='integer').dtype
+        elif pd.api.types.is_float_dtype(df[coluna]):
+            tipos[coluna] = 'float32'
+    return df.astype(tipos)
+
+@instrumentado
+def load_data_em_blocos(path, tamanho_bloco=5000, colunas=None, usar_cache=True, esbocos=False):
+    """Carrega os dados dos navios em blocos, para históricos de vários anos
+
+    Cada bloco é filtrado (Movs != 0), processado e reduzido às colunas pedidas
+    antes do próximo ser lido, então a memória acompanha o tamanho do resultado
+    e não o da planilha bruta. Com esbocos=True retorna também (df, esbocos) os
+    esboços mensais de quantis, montados bloco a bloco (com todas as métricas,
+    em precisão total) e mesclados por mês; o cache guarda as tabelas deles.
+    """
+    colunas = COLUNAS_NAVIOS_COMPACTO if colunas is None else colunas
+    if usar_cache:
+        df = ler_cache(path, 'navios-compacto')
+        if df is not None and all(coluna in df.columns for coluna in colunas):
+            if not esbocos:
+                return df[colunas]
+            valores = ler_cache(path, 'navios-compacto-esbocos')
+            estado = ler_cache(path, 'navios-compacto-esbocos-estado')
+            if valores is not None and estado is not None:
+                return df[colunas], esbocos_de_tabelas(valores, estado)
+
+    blocos, esbocos_blocos = [], {}
+    for bloco in ler_excel_em_blocos(path, tamanho_bloco):
+        bloco = bloco[pd.to_numeric(bloco['Movs'], errors='coerce').fillna(0) != 0]
+        if bloco.empty:
+            continue
+        bloco = bloco.astype({'Movs': 'int64'})
+        for coluna in ['Tempo Estadia Porto', 'Diferença Porto x Operação']:
+            if coluna in bloco.columns:
+                bloco[coluna] = pd.to_numeric(bloco[coluna], errors='coerce')
+        bloco = _processar_navios(bloco)
+        if esbocos:
+            for mes, por_coluna in calcular_esbocos_mensais(bloco).items():
+                esbocos_blocos.setdefault(mes, []).append(por_coluna)
+        blocos.append(_compactar_navios(bloco, colunas))
+
+    df = pd.concat(blocos, ignore_index=True) if blocos else pd.DataFrame(columns=colunas)
+    if usar_cache:
+        gravar_cache(path, 'navios-compacto', df)
+    if not esbocos:
+        return df
+    esbocos = {
+        mes: {coluna: mesclar_esbocos(*(por_coluna[coluna] for por_coluna in partes)) for coluna in partes[0]}
+        for mes, partes in sorted(esbocos_blocos.items())
+    }
+    if usar_cache:
+        valores, estado = tabelas_esbocos(esbocos)
+        gravar_cache(path, 'navios-compacto-esbocos', valores)
+        gravar_cache(path, 'navios-compacto-esbocos-estado', estado)
+    return df, esbocos
+
+# Limites IQR já calculados, por versão dos dados (LRU)
+_CACHE_LIMITES_IQR = OrderedDict()
+MAX_CACHE_LIMITES_IQR = 64
+_TRAVA_CACHE_LIMITES_IQR = threading.Lock()
+
+@instrumentado
+def impressao_digital(df):
+    """Gera uma impressão digital do conteúdo do DataFrame, usada como versão dos dados"""
+    return f"{len(df)}-{int(pd.util.hash_pandas_object(df, index=True).sum()):016x}"
+
+def _codigos_grupo(df, por):
+    """Retorna o código do grupo de cada linha e os rótulos dos grupos"""
+    if por is None:
+        return np.zeros(len(df), dtype=np.intp), pd.Index(['Todos'])
+    codigos, grupos = pd.factorize(df[por], sort=True)
+    return codigos, pd.Index(grupos, name=por)
+
+def _quartis(valores, codigos, n_grupos):
+    """Q1 e Q3 de cada coluna (e grupo) em uma passada; retorna array (grupos, colunas, 2)"""
+    if n_grupos == 1:
+        quartis = np.nanquantile(valores, [0.25, 0.75], axis=0) if len(valores) else np.full((2, valores.shape[1]), np.nan)
+        return quartis.T[np.newaxis]
+    quartis = pd.DataFrame(valores).groupby(codigos).quantile([0.25, 0.75]).unstack()
+    quartis = quartis.reindex(range(n_grupos)).to_numpy()
+    return quartis.reshape(n_grupos, valores.shape[1], 2)
+
+def _dentro_dos_limites(valores, limites, codigos):
+    """Máscara das linhas com todas as colunas dentro dos limites do seu grupo"""
+    valido = codigos >= 0
+    limites_linha = limites[np.where(valido, codigos, 0)]
+    dentro = (valores >= limites_linha[..., 0]) & (valores <= limites_linha[..., 1])
+    return dentro.all(axis=1) & valido
+
+@instrumentado
+def limites_iqr(df, colunas, por=None, encadeado=False, versao=None):
+    """Calcula os limites IQR (Q1 - 1.5*IQR, Q3 + 1.5*IQR) de várias colunas de uma vez
+
+    Com por='Mês' os limites são calculados por grupo. Com encadeado=True cada
+    coluna usa só as linhas mantidas pelas anteriores, como ao aplicar
+    remover_outliers_iqr em sequência. Se versao for informada o resultado é
+    memorizado para aquela versão dos dados.
+    """
+    colunas = [colunas] if isinstance(colunas, str) else list(colunas)
+    chave = (versao, tuple(colunas), por, encadeado)
+    if versao is not None:
+        with _TRAVA_CACHE_LIMITES_IQR:
+            if chave in _CACHE_LIMITES_IQR:
+                _CACHE_LIMITES_IQR.move_to_end(chave)
+                return _CACHE_LIMITES_IQR[chave]
+
+    valores = df[colunas].to_numpy(dtype='float64')
+    codigos, grupos = _codigos_grupo(df, por)
+
+    if encadeado:
+        mascara = codigos >= 0
+        partes = []
+        for j in range(len(colunas)):
+            quartis = _quartis(valores[mascara, j:j + 1], codigos[mascara], len(grupos))
+            iqr = quartis[..., 1] - quartis[..., 0]
+            parte = np.stack([quartis[..., 0] - 1.5 * iqr, quartis[..., 1] + 1.5 * iqr], axis=-1)
+            mascara &= _dentro_dos_limites(valores[:, j:j + 1], parte, codigos)
+            partes.append(parte)
+        limites = np.concatenate(partes, axis=1)
+    else:
+        validos = codigos >= 0
+        quartis = _quartis(valores[validos], codigos[validos], len(grupos))
+        iqr = quartis[..., 1] - quartis[..., 0]
+        limites = np.stack([quartis[..., 0] - 1.5 * iqr, quartis[..., 1] + 1.5 * iqr], axis=-1)
+
+    resultado = pd.DataFrame(
+        limites.reshape(len(grupos), -1),
+        index=grupos,
+        columns=pd.MultiIndex.from_product([colunas, ['limite_inf', 'limite_sup']]),
+    )
+    if versao is not None:
+        with _TRAVA_CACHE_LIMITES_IQR:
+            _CACHE_LIMITES_IQR[chave] = resultado
+            while len(_CACHE_LIMITES_IQR) > MAX_CACHE_LIMITES_IQR:
+                _CACHE_LIMITES_IQR.popitem(last=False)
+    return resultado
+
+@instrumentado
+def mascara_outliers_iqr(df, colunas, por=None, encadeado=False, versao=None, esbocos=None):
+    """Retorna a máscara booleana das linhas dentro dos limites IQR de todas as colunas
+
+    Com esbocos (calcular_esbocos_mensais) os limites são os aproximados dos
+    esboços, sem calcular quartis sobre df; encadeado não se aplica.
+    """
+    colunas = [colunas] if isinstance(colunas, str) else list(colunas)
+    codigos, grupos = _codigos_grupo(df, por)
+    if esbocos is not None:
+        limites = limites_iqr_esbocos(esbocos, colunas, por_mes=por is not None)
+        limites = limites.reindex(grupos) if por is not None else limites
+    else:
+        limites = limites_iqr(df, colunas, por=por, encadeado=encadeado, versao=versao)
+    limites = limites.to_numpy().reshape(len(limites), len(colunas), 2)
+    mascara = _dentro_dos_limites(df[colunas].to_numpy(dtype='float64'), limites, codigos)
+    return pd.Series(mascara, index=df.index)
+
+@instrumentado
 def remover_outliers_iqr(df, coluna):
     """Remove outliers usando o método IQR"""
-    q1 = df[coluna].quantile(0.25)
-    q3 = df[coluna].quantile(0.75)
-    iqr = q3 - q1
-    limite_inf = q1 - 1.5 * iqr
-    limite_sup = q3 + 1.5 * iqr
-    return df[(df[coluna] >= limite_inf) & (df[coluna] <= limite_sup)]
-
-def grafico_tempo_medio(df):
+    return df[mascara_outliers_iqr(df, coluna)]
+
+# Métricas mensais usadas pelos gráficos dos navios
+METRICAS_CUBO = ['Movs', 'Tempo Estadia Porto', 'Tempo de Operação H', 'Diferença Porto x Operação']
+
+@instrumentado
+def calcular_cubo_mensal(df):
+    """Calcula em uma única agregação o cubo Mês x métrica (soma, média, contagem e quartis)"""
+    agrupado = df.groupby('Mês')[METRICAS_CUBO]
+    cubo = agrupado.agg(['sum', 'mean', 'count'])
+    quartis = agrupado.quantile([0.25, 0.5, 0.75]).unstack()
+    quartis.columns = pd.MultiIndex.from_tuples(
+        [(metrica, f"q{int(q * 100)}") for metrica, q in quartis.columns]
+    )
+    ordem = [(metrica, estatistica) for metrica in METRICAS_CUBO
+             for estatistica in ['sum', 'mean', 'count', 'q25', 'q50', 'q75']]
+    return pd.concat([cubo, quartis], axis=1)[ordem]
+
+def _cubo(df, cubo):
+    """Usa o cubo recebido ou calcula a partir do DataFrame"""
+    return cubo if cubo is not None else calcular_cubo_mensal(df)
+
+# Esboços de quantis (KLL) mescláveis: cada esboço guarda ~3k valores amostrados,
+# qualquer que seja o número de linhas, com erro de posto da ordem de 1/k
+K_ESBOCO = 200
+
+def _capacidade_nivel(k, altura, nivel):
+    """Quantos valores o nível guarda antes de ser compactado (os mais altos guardam mais)"""
+    return max(2, int(np.ceil(k * (2 / 3) ** (altura - 1 - nivel))))
+
+def _compactar_esboco(esboco):
+    """Compacta os níveis acima da capacidade: ordena e promove um de cada dois valores"""
+    niveis, paridade, k = esboco['niveis'], esboco['paridade'], esboco['k']
+    while True:
+        altura = len(niveis)
+        capacidades = [_capacidade_nivel(k, altura, nivel) for nivel in range(altura)]
+        if sum(len(valores) for valores in niveis) <= sum(capacidades):
+            break
+        nivel = next(h for h in range(altura) if len(niveis[h]) > capacidades[h])
+        ordenados = np.sort(niveis[nivel])
+        sobra = len(ordenados) % 2
+        # Alterna o valor promovido de cada par para não enviesar o esboço
+        promovidos = ordenados[sobra + paridade::2]
+        paridade ^= 1
+        niveis[nivel] = ordenados[:sobra]
+        if nivel + 1 == altura:
+            niveis.append(np.empty(0))
+        niveis[nivel + 1] = np.concatenate([niveis[nivel + 1], promovidos])
+    esboco['paridade'] = paridade
+    return esboco
+
+def esboco_quantis(valores=(), k=K_ESBOCO):
+    """Cria um esboço de quantis com os valores (NaN são ignorados)"""
+    return inserir_no_esboco({'k': k, 'n': 0, 'niveis': [np.empty(0)], 'paridade': 0}, valores)
+
+def inserir_no_esboco(esboco, valores):
+    """Retorna um novo esboço com os valores acrescentados"""
+    valores = np.asarray(valores, dtype='float64').ravel()
+    valores = valores[~np.isnan(valores)]
+    niveis = list(esboco['niveis'])
+    niveis[0] = np.concatenate([niveis[0], valores])
+    return _compactar_esboco({**esboco, 'n': esboco['n'] + len(valores), 'niveis': niveis})
+
+def mesclar_esbocos(*esbocos):
+    """Combina esboços (ex.: de meses ou anos diferentes) sem reler as linhas"""
+    niveis = [np.empty(0)]
+    for esboco in esbocos:
+        for nivel, valores in enumerate(esboco['niveis']):
+            if nivel == len(niveis):
+                niveis.append(np.empty(0))
+            niveis[nivel] = np.concatenate([niveis[nivel], valores])
+    return _compactar_esboco({
+        'k': min((esboco['k'] for esboco in esbocos), default=K_ESBOCO),
+        'n': sum(esboco['n'] for esboco in esbocos),
+        'niveis': niveis,
+        'paridade': 0,
+    })
+
+def quantis_esboco(esboco, quantis):
+    """Quantis aproximados do esboço (exatos, como np.quantile, enquanto não houve compactação)"""
+    quantis = np.asarray(quantis, dtype='float64')
+    if esboco['n'] == 0:
+        return np.full(quantis.shape, np.nan)
+    if len(esboco['niveis']) == 1:
+        return np.quantile(esboco['niveis'][0], quantis)
+    valores = np.concatenate(esboco['niveis'])
+    pesos = np.concatenate([np.full(len(nivel), 2.0 ** h) for h, nivel in enumerate(esboco['niveis'])])
+    ordem = np.argsort(valores, kind='stable')
+    acumulado = np.cumsum(pesos[ordem])
+    posicoes = np.searchsorted(acumulado, quantis * acumulado[-1], 'left')
+    return valores[ordem][np.minimum(posicoes, len(valores) - 1)]
+
+@instrumentado
+def calcular_esbocos_mensais(df, colunas=METRICAS_CUBO, por='Mês', k=K_ESBOCO):
+    """Esboço de quantis de cada métrica em cada mês: {mês: {coluna: esboço}}"""
+    valores = df[list(colunas)].to_numpy(dtype='float64')
+    return {
+        grupo: {coluna: esboco_quantis(valores[linhas, j], k) for j, coluna in enumerate(colunas)}
+        for grupo, linhas in df.groupby(por).indices.items()
+    }
+
+@instrumentado
+def atualizar_esbocos_mensais(esbocos, df, meses, por='Mês'):
+    """Refaz os esboços apenas dos meses afetados"""
+    colunas = list(next(iter(esbocos.values()))) if esbocos else METRICAS_CUBO
+    k = next((esboco['k'] for por_coluna in esbocos.values() for esboco in por_coluna.values()), K_ESBOCO)
+    parcial = calcular_esbocos_mensais(df[df[por].isin(meses)], colunas, por, k)
+    atualizados = {grupo: por_coluna for grupo, por_coluna in esbocos.items() if grupo not in set(meses)}
+    atualizados.update(parcial)
+    return dict(sorted(atualizados.items()))
+
+def tabelas_esbocos(esbocos):
+    """Esboços mensais em duas tabelas, para gravar junto das agregações
+
+    Retorna (valores, estado): valores tem uma linha por valor guardado (id do
+    esboço, nível, valor) e estado uma linha por (Mês, coluna) com k, n,
+    paridade e número de níveis; o id de cada esboço é a posição dele em estado.
+    """
+    chaves, estado, ids, niveis, valores = [], [], [], [], []
+    for mes, por_coluna in esbocos.items():
+        for coluna, esboco in por_coluna.items():
+            for nivel, guardados in enumerate(esboco['niveis']):
+                ids.append(np.full(len(guardados), len(chaves)))
+                niveis.append(np.full(len(guardados), nivel))
+                valores.append(guardados)
+            chaves.append((mes, coluna))
+            estado.append((esboco['k'], esboco['n'], esboco['paridade'], len(esboco['niveis'])))
+    tabela_valores = pd.DataFrame({
+        'esboco': np.concatenate(ids or [np.empty(0)]).astype('int32'),
+        'nivel': np.concatenate(niveis or [np.empty(0)]).astype('int8'),
+        'valor': np.concatenate(valores or [np.empty(0)]).astype('float64'),
+    })
+    tabela_estado = pd.DataFrame(
+        estado, columns=['k', 'n', 'paridade', 'niveis'],
+        index=pd.MultiIndex.from_tuples(chaves, names=['Mês', 'coluna']) if chaves else None,
+    ).astype('int64')
+    return tabela_valores, tabela_estado
+
+def esbocos_de_tabelas(valores, estado):
+    """Remonta os esboços mensais ({mês: {coluna: esboço}}) a partir de tabelas_esbocos"""
+    posicoes = valores.groupby(['esboco', 'nivel']).indices if len(valores) else {}
+    guardados = valores['valor'].to_numpy(dtype='float64') if len(valores) else np.empty(0)
+    esbocos = {}
+    for i, ((mes, coluna), linha) in enumerate(estado.iterrows()):
+        esbocos.setdefault(mes, {})[coluna] = {
+            'k': int(linha['k']),
+            'n': int(linha['n']),
+            'niveis': [guardados[posicoes[(i, nivel)]] if (i, nivel) in posicoes else np.empty(0)
+                       for nivel in range(int(linha['niveis']))],
+            'paridade': int(linha['paridade']),
+        }
+    return esbocos
+
+def limites_iqr_esbocos(esbocos, colunas, meses=None, por_mes=False):
+    """Limites IQR aproximados a partir dos esboços mensais, no formato de limites_iqr
+
+    Com por_mes=False os esboços dos meses (todos ou os de meses) são mesclados
+    em um único grupo 'Todos'; as colunas são tratadas de forma independente.
+    """
+    colunas = [colunas] if isinstance(colunas, str) else list(colunas)
+    selecionados = {grupo: esbocos[grupo] for grupo in (esbocos if meses is None else meses) if grupo in esbocos}
+    if por_mes:
+        grupos = pd.Index(list(selecionados), name='Mês')
+        por_grupo = list(selecionados.values())
+    else:
+        grupos = pd.Index(['Todos'])
+        por_grupo = [{coluna: mesclar_esbocos(*(por_coluna[coluna] for por_coluna in selecionados.values()))
+                      for coluna in colunas}]
+
+    limites = np.empty((len(grupos), len(colunas), 2))
+    for i, por_coluna in enumerate(por_grupo):
+        for j, coluna in enumerate(colunas):
+            q1, q3 = quantis_esboco(por_coluna[coluna], [0.25, 0.75])
+            limites[i, j] = [q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1)]
+    return pd.DataFrame(
+        limites.reshape(len(grupos), -1),
+        index=grupos,
+        columns=pd.MultiIndex.from_product([colunas, ['limite_inf', 'limite_sup']]),
+    )
+
+# Chave de um registro de atracação (deduplicação na ingestão incremental)
+CHAVE_NAVIO = ['Navio / Viagem', 'Atracação']
+
+@instrumentado
+def mesclar_registros_navios(df, novos, processados=False):
+    """Acrescenta registros novos ou alterados sem reprocessar o histórico
+
+    novos vem direto da planilha e é processado como no load_data (ou, com
+    processados=True, já no formato do load_data). Registros com a mesma chave
+    (navio/viagem e atracação) substituem os existentes. Retorna o DataFrame
+    atualizado e os meses afetados.
+    """
+    if not processados:
+        novos = _processar_navios(novos.copy())
+    if 'Movs_h' in df.columns and 'Movs_h' not in novos.columns:
+        novos = processar_dados_navios_hipoteses(novos)
+    novos = novos.drop_duplicates(CHAVE_NAVIO, keep='last')
+
+    substituidos = pd.MultiIndex.from_frame(df[CHAVE_NAVIO]).isin(pd.MultiIndex.from_frame(novos[CHAVE_NAVIO]))
+    meses = pd.Index(novos['Mês']).append(pd.Index(df.loc[substituidos, 'Mês'])).unique()
+
+    inicio = df.index.max() + 1 if len(df) else 0
+    novos = novos.reindex(columns=df.columns).set_axis(pd.RangeIndex(inicio, inicio + len(novos)))
+    return pd.concat([df[~substituidos], novos]), meses
+
+@instrumentado
+def atualizar_cubo_mensal(cubo, df, meses):
+    """Recalcula no cubo mensal apenas os meses afetados"""
+    parcial = calcular_cubo_mensal(df[df['Mês'].isin(meses)])
+    return pd.concat([cubo.drop(index=meses, errors='ignore'), parcial]).sort_index()
+
+@instrumentado
+def atualizar_medias_sem_outliers(medias, df, meses, por='Mês'):
+    """Recalcula as médias sem outliers (calcular_medias_tratadas) apenas dos meses afetados"""
+    parcial = calcular_medias_tratadas(df[df[por].isin(meses)], list(medias.columns), por=por)
+    return pd.concat([medias.drop(index=meses, errors='ignore'), parcial]).sort_index()
+
+@instrumentado
+def ingerir_navios_incremental(df, novos, cubo, medias_sem_outliers=None, processados=False, esbocos=None):
+    """Aplica um lote de registros novos ao DataFrame e às agregações mensais
+
+    Só os meses tocados pelo lote são recalculados. Retorna o DataFrame, o cubo,
+    as médias sem outliers (se informadas), os meses afetados e os esboços
+    mensais de quantis (se informados).
+    """
+    df, meses = mesclar_registros_navios(df, novos, processados)
+    cubo = atualizar_cubo_mensal(cubo, df, meses)
+    if medias_sem_outliers is not None:
+        medias_sem_outliers = atualizar_medias_sem_outliers(medias_sem_outliers, df, meses)
+    if esbocos is not None:
+        esbocos = atualizar_esbocos_mensais(esbocos, df, meses)
+    return df, cubo, medias_sem_outliers, meses, esbocos
+
+@instrumentado
+def grafico_tempo_medio(df, cubo=None):
     """Gráfico de tempo médio de estadia no porto vs tempo de operação"""
-    # Agrupar dados por mês
-    avg_data_mes = df.groupby('Mês').agg(
-        {'Tempo Estadia Porto': 'mean', 'Tempo de Operação H': 'mean'}
-    ).reset_index()
+    # Médias mensais a partir do cubo
+    cubo = _cubo(df, cubo)
+    avg_data_mes = pd.DataFrame({
+        'Mês': rotulos_mes(cubo.index),
+        'Tempo Estadia Porto': cubo[('Tempo Estadia Porto', 'mean')].values,
+        'Tempo de Operação H': cubo[('Tempo de Operação H', 'mean')].values,
+    })
 
     # Derreter o DataFrame para formato long
     df_melted = avg_data_mes.melt(
@@ -69,14 +823,28 @@ def grafico_tempo_medio(df):
 
     return fig
 
-def grafico_tempo_medio_tratado(df):
-    """Gráfico de tempo médio tratado (sem outliers)"""
-    df_filtrado = remover_outliers_iqr(df, 'Tempo Estadia Porto')
-    df_filtrado = remover_outliers_iqr(df_filtrado, 'Tempo de Operação H')
+# Colunas dos gráficos sem outliers, na ordem em que os filtros IQR são encadeados
+COLUNAS_TEMPO_MEDIO_TRATADO = ['Tempo Estadia Porto', 'Tempo de Operação H']
+COLUNAS_ESTADIA_OPERACAO_TRATADO = ['Tempo de Operação H', 'Diferença Porto x Operação']
+
+@instrumentado
+def calcular_medias_tratadas(df, colunas, versao=None, esbocos=None, por='Mês'):
+    """Médias mensais das colunas sem outliers (filtros IQR encadeados, com limites de cada mês)
 
-    avg_data_mes = df_filtrado.groupby('Mês').agg(
-        {'Tempo Estadia Porto': 'mean', 'Tempo de Operação H': 'mean'}
-    ).reset_index()
+    Os limites de um mês só dependem dos registros dele, então um lote novo
+    só muda as médias dos meses que toca (atualizar_medias_sem_outliers).
+    """
+    mascara = mascara_outliers_iqr(df, colunas, por=por, encadeado=True, versao=versao, esbocos=esbocos)
+    return df.loc[mascara, [por] + list(colunas)].groupby(por)[list(colunas)].mean()
+
+@instrumentado
+def grafico_tempo_medio_tratado(df, versao=None, esbocos=None, medias=None):
+    """Gráfico de tempo médio tratado (sem outliers); medias pode vir pré-calculada"""
+    if medias is None:
+        medias = calcular_medias_tratadas(df, COLUNAS_TEMPO_MEDIO_TRATADO, versao, esbocos)
+
+    avg_data_mes = medias[COLUNAS_TEMPO_MEDIO_TRATADO].reset_index()
+    avg_data_mes['Mês'] = rotulos_mes(avg_data_mes['Mês'])
 
     df_melted = avg_data_mes.melt(
         id_vars=['Mês'],
@@ -101,12 +869,15 @@ def grafico_tempo_medio_tratado(df):
 
     return fig
 
-def media_dif_estadia_operacao(df):
+@instrumentado
+def media_dif_estadia_operacao(df, cubo=None):
     """Gráfico de média da diferença entre estadia e operação"""
-    monthly_avg_times = df.groupby('Mês').agg(
-        avg_tempo_operacao=('Tempo de Operação H', 'mean'),
-        avg_diferenca_nao_operacional=('Diferença Porto x Operação', 'mean')
-    ).reset_index()
+    cubo = _cubo(df, cubo)
+    monthly_avg_times = pd.DataFrame({
+        'Mês': rotulos_mes(cubo.index),
+        'avg_tempo_operacao': cubo[('Tempo de Operação H', 'mean')].values,
+        'avg_diferenca_nao_operacional': cubo[('Diferença Porto x Operação', 'mean')].values,
+    })
 
     df_melted_stack = monthly_avg_times.melt(
         id_vars=['Mês'],
@@ -135,15 +906,17 @@ def media_dif_estadia_operacao(df):
 
     return fig
 
-def media_dif_estadia_operacao_tratado(df):
-    """Gráfico de média da diferença entre estadia e operação (tratado)"""
-    df_filtrado = remover_outliers_iqr(df, 'Tempo de Operação H')
-    df_filtrado = remover_outliers_iqr(df_filtrado, 'Diferença Porto x Operação')
+@instrumentado
+def media_dif_estadia_operacao_tratado(df, versao=None, esbocos=None, medias=None):
+    """Gráfico de média da diferença entre estadia e operação (tratado); medias pode vir pré-calculada"""
+    if medias is None:
+        medias = calcular_medias_tratadas(df, COLUNAS_ESTADIA_OPERACAO_TRATADO, versao, esbocos)
 
-    monthly_avg_times = df_filtrado.groupby('Mês').agg(
-        avg_tempo_operacao=('Tempo de Operação H', 'mean'),
-        avg_diferenca_nao_operacional=('Diferença Porto x Operação', 'mean')
-    ).reset_index()
+    monthly_avg_times = medias[COLUNAS_ESTADIA_OPERACAO_TRATADO].rename(columns={
+        'Tempo de Operação H': 'avg_tempo_operacao',
+        'Diferença Porto x Operação': 'avg_diferenca_nao_operacional',
+    }).reset_index()
+    monthly_avg_times['Mês'] = rotulos_mes(monthly_avg_times['Mês'])
 
     df_melted_stack = monthly_avg_times.melt(
         id_vars=['Mês'],
@@ -173,9 +946,11 @@ def media_dif_estadia_operacao_tratado(df):
 
     return fig
 
-def grafico_movs_mes(df):
+@instrumentado
+def grafico_movs_mes(df, cubo=None):
     """Gráfico de total de movimentações por mês"""
-    total_movs_mes = df.groupby('Mês')['Movs'].sum().reset_index()
+    cubo = _cubo(df, cubo)
+    total_movs_mes = pd.DataFrame({'Mês': rotulos_mes(cubo.index), 'Movs': cubo[('Movs', 'sum')].values})
 
     fig = px.bar(
         total_movs_mes,
@@ -191,15 +966,15 @@ def grafico_movs_mes(df):
 
     return fig
 
-def grafico_horasxmovs_mes(df):
+@instrumentado
+def grafico_horasxmovs_mes(df, cubo=None):
     """Gráfico comparativo de movimentações vs horas de operação"""
-    monthly_totals = df.groupby('Mês').agg(
-        total_movs=('Movs', 'sum'),
-        total_tempo_operacao_h=('Tempo de Operação H', 'sum')
-    ).reset_index()
-
-    monthly_totals['Mês_ordenado'] = pd.to_datetime(monthly_totals['Mês'], format='%m/%Y')
-    monthly_totals = monthly_totals.sort_values('Mês_ordenado').drop(columns='Mês_ordenado')
+    cubo = _cubo(df, cubo)
+    monthly_totals = pd.DataFrame({
+        'Mês': rotulos_mes(cubo.index),
+        'total_movs': cubo[('Movs', 'sum')].values,
+        'total_tempo_operacao_h': cubo[('Tempo de Operação H', 'sum')].values,
+    })
 
     fig = go.Figure()
 
@@ -249,12 +1024,15 @@ def grafico_horasxmovs_mes(df):
 
     return fig
 
-def grafico_hipoteses(df):
+@instrumentado
+def grafico_hipoteses(df, cubo=None):
     """Gráfico para análise da primeira hipótese"""
-    monthly_summary_estadia = df.groupby('Mês').agg(
-        total_movs=('Movs', 'sum'),
-        total_tempo_estadia_h=('Tempo Estadia Porto', 'sum')
-    ).reset_index()
+    cubo = _cubo(df, cubo)
+    monthly_summary_estadia = pd.DataFrame({
+        'Mês': rotulos_mes(cubo.index),
+        'total_movs': cubo[('Movs', 'sum')].values,
+        'total_tempo_estadia_h': cubo[('Tempo Estadia Porto', 'sum')].values,
+    })
 
     fig = go.Figure()
 
@@ -304,12 +1082,14 @@ def grafico_hipoteses(df):
 
     return fig
 
-def grafico_dif_porto_operacao(df):
+@instrumentado
+def grafico_dif_porto_operacao(df, cubo=None):
     """Gráfico da diferença média entre porto e operação"""
-    avg_diff_porto_operacao_mensal = df.groupby('Mês')['Diferença Porto x Operação'].mean().reset_index()
-
-    avg_diff_porto_operacao_mensal['Mês_ordenado'] = pd.to_datetime(avg_diff_porto_operacao_mensal['Mês'], format='%m/%Y')
-    avg_diff_porto_operacao_mensal = avg_diff_porto_operacao_mensal.sort_values('Mês_ordenado').drop(columns='Mês_ordenado')
+    cubo = _cubo(df, cubo)
+    avg_diff_porto_operacao_mensal = pd.DataFrame({
+        'Mês': rotulos_mes(cubo.index),
+        'Diferença Porto x Operação': cubo[('Diferença Porto x Operação', 'mean')].values,
+    })
 
     fig = px.bar(
         avg_diff_porto_operacao_mensal,
@@ -325,51 +1105,505 @@ def grafico_dif_porto_operacao(df):
 
     return fig
 
-def carregar_dados_comex(path_comex):
-    """Carrega e processa os dados de comércio exterior"""
-    df_comex = pd.read_excel(path_comex)
-    df_comex['Mês'] = df_comex['Mês'].astype(str).str.extract(r'(\d{2})').astype(int)
-    df_comex['Total_2024_Kg'] = df_comex['Exportação - 2024 - Quilograma Líquido'] + df_comex['Importação - 2024 - Quilograma Líquido']
-    df_comex['FOB_2024_por_kg'] = df_comex['Exportação - 2024 - Valor US$ FOB'] / df_comex['Exportação - 2024 - Quilograma Líquido'].replace(0, np.nan)
+# Colunas de dimensão do Comex Stat guardadas como categóricas
+COLUNAS_DIMENSAO_COMEX = [
+    'Município', 'País', 'Descrição Seção', 'Código Seção', 'Descrição SH2', 'Descrição SH4',
+]
+
+def _mes_comex(meses):
+    """Converte o mês do Comex Stat ('05. Maio') em inteiro, interpretando só os valores distintos"""
+    if pd.api.types.is_numeric_dtype(meses):
+        return meses.astype('int8')
+    categorias = meses.astype('category')
+    numeros = [int(str(valor)[:2]) for valor in categorias.cat.categories]
+    return pd.Series(np.asarray(numeros, dtype='int8')[categorias.cat.codes], index=meses.index)
+
+def _compactar_comex(df_comex, ano=2024):
+    """Dimensões como categóricas, medidas inteiras reduzidas e FOB/kg em float32"""
+    tipos = {coluna: 'category' for coluna in COLUNAS_DIMENSAO_COMEX if coluna in df_comex.columns}
+    for coluna in df_comex.columns:
+        if coluna not in tipos and pd.api.types.is_integer_dtype(df_comex[coluna]):
+            tipos[coluna] = pd.to_numeric(df_comex[coluna], downcast='integer').dtype
+    tipos[f'FOB_{ano}_por_kg'] = 'float32'
+    return df_comex.astype(tipos)
+
+@instrumentado
+def carregar_dados_comex(path_comex, usar_cache=True, ano=2024, apenas_cache=False):
+    """Carrega e processa os dados de comércio exterior de um ano da planilha
+
+    Com apenas_cache=True retorna None em vez de ler a planilha.
+    """
+    tipo = 'comex' if ano == 2024 else f'comex-{ano}'
+    if usar_cache:
+        df_comex = ler_cache(path_comex, tipo)
+        if df_comex is not None:
+            return df_comex
+    if apenas_cache:
+        return None
+
+    with etapa('read_excel'):
+        df_comex = pd.read_excel(path_comex)
+    df_comex = _processar_comex(df_comex, ano)
+
+    if usar_cache:
+        gravar_cache(path_comex, tipo, df_comex)
+
     return df_comex
 
+@instrumentado
+def _processar_comex(df_comex, ano=2024):
+    """Extrai o mês, calcula os totais do ano e compacta os tipos"""
+    df_comex['Mês'] = _mes_comex(df_comex['Mês'])
+    df_comex[f'Total_{ano}_Kg'] = df_comex[f'Exportação - {ano} - Quilograma Líquido'] + df_comex[f'Importação - {ano} - Quilograma Líquido']
+    df_comex[f'FOB_{ano}_por_kg'] = df_comex[f'Exportação - {ano} - Valor US$ FOB'] / df_comex[f'Exportação - {ano} - Quilograma Líquido'].replace(0, np.nan)
+    return _tipos_arrow(_compactar_comex(df_comex, ano))
+
+# Base particionada em disco: raiz/porto=<porto>/ano=<ano>/mes=<mes>/parte-0.parquet
+# (o Comex Stat não tem porto e é particionado só por ano/mês)
+PARTICOES_NAVIOS = pa.schema([('porto', pa.string()), ('ano', pa.int16()), ('mes', pa.int8())])
+PARTICOES_COMEX = pa.schema([('ano', pa.int16()), ('mes', pa.int8())])
+
+# Medidas do Comex Stat sem o ano no nome (formato longo da base particionada)
+MEDIDAS_COMEX = [
+    'Exportação - Valor US$ FOB', 'Exportação - Quilograma Líquido',
+    'Importação - Valor US$ FOB', 'Importação - Quilograma Líquido',
+]
+
+def gravar_particoes(df, raiz, particoes):
+    """Grava df na base particionada, substituindo só as partições presentes em df"""
+    tabela = pa.Table.from_pandas(_tipos_arrow(df), preserve_index=False)
+    tabela = tabela.cast(pa.schema([
+        particoes.field(nome) if nome in particoes.names else campo for nome, campo in zip(tabela.column_names, tabela.schema)
+    ], metadata=tabela.schema.metadata))
+    pq.write_to_dataset(
+        tabela, raiz,
+        partitioning=ds.partitioning(particoes, flavor='hive'),
+        existing_data_behavior='delete_matching',
+        basename_template='parte-{i}.parquet',
+    )
+
+def _caminhos_particoes(raiz, particoes, filtros):
+    """Arquivos das partições que atendem aos filtros, descendo só pelos diretórios selecionados
+
+    Diretórios de outros portos/anos/meses nem são listados; a ordem é a numérica das chaves.
+    """
+    diretorios = [raiz]
+    for campo in particoes:
+        permitidos = filtros.get(campo.name)
+        permitidos = None if permitidos is None else {str(valor) for valor in permitidos}
+        proximos = []
+        for diretorio in diretorios:
+            if not os.path.isdir(diretorio):
+                continue
+            filhos = []
+            for nome in os.listdir(diretorio):
+                chave, _, valor = nome.partition('=')
+                if chave == campo.name and (permitidos is None or valor in permitidos):
+                    filhos.append((int(valor) if pa.types.is_integer(campo.type) else valor, nome))
+            proximos.extend(os.path.join(diretorio, nome) for _, nome in sorted(filhos))
+        diretorios = proximos
+    return [
+        os.path.join(diretorio, nome)
+        for diretorio in diretorios for nome in sorted(os.listdir(diretorio)) if nome.endswith('.parquet')
+    ]
+
+@instrumentado
+def ler_particoes(raiz, particoes, filtros=None, colunas=None):
+    """Lê da base particionada só as partições dos filtros e só as colunas pedidas
+
+    filtros: dicionário {chave da partição: valores aceitos}, ex. {'ano': [2024], 'mes': [10, 11]}.
+    As chaves das partições entram no resultado quando colunas é None ou as inclui.
+    """
+    arquivos = _caminhos_particoes(raiz, particoes, filtros or {})
+    if not arquivos:
+        return None
+    with etapa('ler partições', arquivos=len(arquivos)):
+        dataset = ds.dataset(arquivos, format='parquet', partitioning=ds.partitioning(particoes, flavor='hive'),
+                             partition_base_dir=raiz)
+        return dataset.to_table(columns=colunas).to_pandas()
+
+def gravar_particoes_navios(df, raiz, porto):
+    """Grava os navios processados (saída de load_data) em raiz/porto=/ano=/mes=
+
+    Navios sem Atracação (célula vazia na planilha) não têm ano/mês de
+    partição: não são gravados e são retornados para quem chamou reportar.
+    """
+    sem_atracacao = df['Atracação'].isna()
+    validos = df[~sem_atracacao]
+    particoes = pd.DataFrame({
+        'porto': porto,
+        'ano': validos['Atracação'].dt.year.astype('int16'),
+        'mes': validos['Atracação'].dt.month.astype('int8'),
+    }, index=validos.index)
+    gravar_particoes(pd.concat([validos, particoes], axis=1), raiz, PARTICOES_NAVIOS)
+    return df[sem_atracacao]
+
+@instrumentado
+def ler_particoes_navios(raiz, portos=None, anos=None, meses=None, colunas=None):
+    """Navios dos portos/anos/meses pedidos, no formato de load_data (None se não houver partições)"""
+    return ler_particoes(raiz, PARTICOES_NAVIOS, {'porto': portos, 'ano': anos, 'mes': meses}, colunas)
+
+def anos_comex(df_comex):
+    """Anos que têm colunas de medida na planilha do Comex Stat"""
+    return sorted({int(coluna.split(' - ')[1]) for coluna in df_comex.columns
+                   if coluna.startswith(('Exportação - ', 'Importação - ')) and coluna.count(' - ') == 2})
+
+def comex_formato_longo(df_comex):
+    """Planilha do Comex Stat (uma coluna de medida por ano) em formato longo, com a coluna 'ano'"""
+    anos = anos_comex(df_comex)
+    colunas_ano = {
+        f"{medida.split(' - ')[0]} - {ano} - {medida.split(' - ')[1]}" for medida in MEDIDAS_COMEX for ano in anos
+    }
+    dimensoes = df_comex.drop(columns=[coluna for coluna in df_comex.columns if coluna in colunas_ano])
+    dimensoes = dimensoes.assign(mes=_mes_comex(dimensoes['Mês']))
+    partes = []
+    for ano in anos:
+        medidas = {
+            medida: df_comex[f"{medida.split(' - ')[0]} - {ano} - {medida.split(' - ')[1]}"] for medida in MEDIDAS_COMEX
+        }
+        partes.append(dimensoes.assign(ano=np.int16(ano), **medidas))
+    return pd.concat(partes, ignore_index=True)
+
+def comex_do_ano(df_longo, ano):
+    """Volta do formato longo para as colunas '<fluxo> - <ano> - <medida>' usadas pelo processamento"""
+    df_ano = df_longo[df_longo['ano'] == ano].drop(columns=['ano', 'mes'], errors='ignore')
+    return df_ano.rename(columns={
+        medida: f"{medida.split(' - ')[0]} - {ano} - {medida.split(' - ')[1]}" for medida in MEDIDAS_COMEX
+    }).reset_index(drop=True)
+
+def gravar_particoes_comex(df_comex, raiz):
+    """Grava a planilha bruta do Comex Stat em raiz/ano=/mes=, em formato longo"""
+    gravar_particoes(comex_formato_longo(df_comex), raiz, PARTICOES_COMEX)
+
+@instrumentado
+def ler_particoes_comex(raiz, ano=2024, meses=None, colunas=None):
+    """Comex Stat de um ano lido da base particionada e processado como em carregar_dados_comex"""
+    if colunas is not None:
+        colunas = list(dict.fromkeys(['Mês', *colunas, *MEDIDAS_COMEX]))
+    df_longo = ler_particoes(raiz, PARTICOES_COMEX, {'ano': [ano], 'mes': meses}, colunas)
+    if df_longo is None:
+        return None
+    return _processar_comex(comex_do_ano(df_longo.assign(ano=ano), ano), ano)
+
+def carregar_navios_base(path, dir_base=None, porto=None, ano=None, quarentena=False, apenas_cache=False):
+    """Navios do porto/ano na base particionada, ou da planilha se a base não tiver as partições
+
+    Com quarentena=True retorna (df, quarentena); a base particionada só guarda
+    linhas válidas e, vindo dela, a quarentena é None. Com apenas_cache=True
+    retorna None se for preciso ler a planilha.
+    """
+    if dir_base is not None:
+        df = ler_particoes_navios(os.path.join(dir_base, 'navios'), portos=[porto], anos=[ano])
+        if df is not None:
+            return (df, None) if quarentena else df
+    return load_data(path, quarentena=quarentena, apenas_cache=apenas_cache)
+
+def carregar_comex_base(path, dir_base=None, ano=2024, apenas_cache=False):
+    """Comex Stat do ano na base particionada, ou da planilha se a base não tiver as partições"""
+    if dir_base is not None:
+        df_comex = ler_particoes_comex(os.path.join(dir_base, 'comex'), ano=ano)
+        if df_comex is not None:
+            return df_comex
+    return carregar_dados_comex(path, ano=ano, apenas_cache=apenas_cache)
+
+def _executar_fonte(funcao, args):
+    """Roda um loader no processo do pool, coletando os spans dele"""
+    iniciar_coleta_etapas()
+    return funcao(*args), etapas_coletadas()
+
+def _carregar_sem_planilha(funcao, args):
+    """Resultado do loader vindo só do cache/base particionada (None se precisar ler a planilha)"""
+    if 'apenas_cache' not in inspect.signature(funcao).parameters:
+        return None
+    return funcao(*args, apenas_cache=True)
+
+# Tempo máximo (s) para todas as fontes carregarem antes de serem dadas como falha
+TIMEOUT_FONTES = 300
+
+def carregar_fontes(fontes, processos=None, timeout=TIMEOUT_FONTES):
+    """Carrega as fontes, lendo as planilhas em paralelo só quando há mais de uma a ler
+
+    fontes: dicionário {nome: (funcao, *args)}, com funções de módulo. Primeiro,
+    no próprio processo, cada fonte tenta o cache Parquet/base particionada
+    (loaders com apenas_cache); só as que precisam ler planilha seguem adiante:
+    uma só (ou processos=1) é lida aqui mesmo e duas ou mais vão para um pool spawn
+    (um fork a partir do servidor do Streamlit, multi-thread, pode herdar travas;
+    cada processo novo custa ~1 s de importação). Retorna (dados, erros): os
+    resultados das fontes que carregaram e, para as que falharam ou não
+    terminaram em timeout segundos, a mensagem do erro, sem interromper as demais.
+    """
+    dados, erros, pendentes = {}, {}, {}
+    with etapa('carregar_fontes', fontes=len(fontes)):
+        for nome, (funcao, *args) in fontes.items():
+            try:
+                resultado = _carregar_sem_planilha(funcao, args)
+            except Exception as erro:
+                erros[nome] = f"{type(erro).__name__}: {erro}"
+                continue
+            if resultado is None:
+                pendentes[nome] = (funcao, args)
+            else:
+                dados[nome] = resultado
+
+        if len(pendentes) < 2 or processos == 1:
+            for nome, (funcao, args) in pendentes.items():
+                try:
+                    dados[nome] = funcao(*args)
+                except Exception as erro:
+                    erros[nome] = f"{type(erro).__name__}: {erro}"
+        elif pendentes:
+            _carregar_em_processos(pendentes, processos, timeout, dados, erros)
+    return dados, erros
+
+def _carregar_em_processos(pendentes, processos, timeout, dados, erros):
+    """Lê as fontes pendentes em um pool spawn, com prazo único; preenche dados e erros"""
+    coletando = getattr(_COLETA_ETAPAS, 'spans', None) is not None
+    deslocamento_ms = (time.perf_counter() - _COLETA_ETAPAS.inicio) * 1000 if coletando else 0
+    profundidade = len(_COLETA_ETAPAS.pilha) if coletando else 0
+    prazo, travou = time.monotonic() + timeout, False
+    pool = multiprocessing.get_context('spawn').Pool(min(processos or len(pendentes), len(pendentes)))
+    try:
+        tarefas = {nome: pool.apply_async(_executar_fonte, (funcao, args)) for nome, (funcao, args) in pendentes.items()}
+        for nome, tarefa in tarefas.items():
+            try:
+                dados[nome], spans = tarefa.get(timeout=max(prazo - time.monotonic(), 0))
+            except multiprocessing.TimeoutError:
+                erros[nome] = f"TimeoutError: a fonte não carregou em {timeout} s"
+                travou = True
+                continue
+            except Exception as erro:
+                erros[nome] = f"{type(erro).__name__}: {erro}"
+                continue
+            # Spans do processo filho entram na coleta atual, abaixo de carregar_fontes
+            if coletando:
+                _COLETA_ETAPAS.spans.extend({
+                    **span,
+                    'inicio_ms': span['inicio_ms'] + deslocamento_ms,
+                    'profundidade': span['profundidade'] + profundidade,
+                    'fonte': nome,
+                } for span in spans)
+    finally:
+        # Não espera processos travados: o pool é encerrado à força
+        if travou:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+
+@instrumentado
+def calcular_rollups_comex(df_comex, ano=2024):
+    """Pré-agrega os totais do comércio exterior usados pelos gráficos de top-N
+
+    'pais' e 'municipio_secao' somam o FOB exportado, 'secao_valor_kg' é o FOB/kg
+    médio das linhas acima de US$ 50 e 'mes' soma os kg exportados + importados.
+    """
+    fob = f'Exportação - {ano} - Valor US$ FOB'
+    valiosos = df_comex[f'FOB_{ano}_por_kg'] > 50
+    return {
+        'ano': ano,
+        'pais': df_comex.groupby('País', observed=True)[fob].sum(),
+        'municipio_secao': df_comex.groupby(['Município', 'Descrição Seção'], observed=True)[fob].sum(),
+        'secao_valor_kg': df_comex[valiosos].groupby('Descrição Seção', observed=True)[f'FOB_{ano}_por_kg'].mean(),
+        'mes': df_comex.groupby('Mês')[f'Total_{ano}_Kg'].sum(),
+        'total_exportado': df_comex[fob].sum(),
+    }
+
+def _rollups(df_comex, rollups):
+    """Usa os rollups recebidos ou calcula a partir do DataFrame"""
+    return rollups if rollups is not None else calcular_rollups_comex(df_comex)
+
+def top_n(serie, n=10):
+    """Maiores n valores em ordem decrescente, por seleção parcial (sem ordenar a série toda)"""
+    return serie.nlargest(n)
+
+def participacao_top_n(rollups, n=3):
+    """Percentual das exportações concentrado nos n principais países"""
+    pct = (top_n(rollups['pais'], n) / rollups['total_exportado'] * 100).round(2)
+    return pct.sum()
+
+# Motivos (bits da coluna 'Flags_Operacao') para a operação não entrar nas métricas de eficiência
+OPERACAO_SEM_HORARIO = 1    # Início ou Fim Operação ausente
+OPERACAO_DURACAO_ZERO = 2   # Fim Operação igual ao Início
+OPERACAO_INVERTIDA = 4      # Fim Operação antes do Início
+MOTIVOS_FLAGS_OPERACAO = {
+    OPERACAO_SEM_HORARIO: 'Sem início/fim da operação',
+    OPERACAO_DURACAO_ZERO: 'Operação com duração zero',
+    OPERACAO_INVERTIDA: 'Fim da operação antes do início',
+}
+
+def flags_operacao(tempo_operacao_h):
+    """Bitmask com os motivos de invalidez de cada intervalo de operação (0 = válido)"""
+    horas = np.asarray(tempo_operacao_h, dtype='float64')
+    return (
+        np.isnan(horas) * OPERACAO_SEM_HORARIO
+        | (horas == 0) * OPERACAO_DURACAO_ZERO
+        | (horas < 0) * OPERACAO_INVERTIDA
+    ).astype('uint8')
+
+@instrumentado
 def processar_dados_navios_hipoteses(df):
-    """Processa dados dos navios para as novas hipóteses"""
-    df['Ano'] = df['Atracação'].dt.year
-    df['Tempo_Operacao_h'] = df['Tempo de Operação H']
-    df['Movs_h'] = df['Movs'] / df['Tempo_Operacao_h']
-    return df
+    """Processa dados dos navios para as novas hipóteses (retorna um novo DataFrame, sem alterar df)
+
+    Operações com intervalo inválido ficam marcadas em 'Flags_Operacao' e com
+    'Movs_h' NaN, fora das médias de eficiência.
+    """
+    tempo_operacao_h = df['Tempo de Operação H'].to_numpy(dtype='float64')
+    flags = flags_operacao(tempo_operacao_h)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        movs_h = np.where(flags == 0, df['Movs'].to_numpy() / tempo_operacao_h, np.nan)
+    derivadas = pd.DataFrame({
+        'Ano': df['Atracação'].dt.year,
+        'Tempo_Operacao_h': df['Tempo de Operação H'],
+        'Movs_h': movs_h,
+        'Flags_Operacao': flags,
+    }, index=df.index)
+    return pd.concat([df.drop(columns=derivadas.columns, errors='ignore'), derivadas], axis=1, copy=False)
+
+def resumo_flags_operacao(df):
+    """Quantidade de operações por motivo de exclusão das métricas de eficiência"""
+    flags = df['Flags_Operacao'].to_numpy()
+    return pd.Series(
+        {motivo: int(np.count_nonzero(flags & bit)) for bit, motivo in MOTIVOS_FLAGS_OPERACAO.items()},
+        name='Operações excluídas',
+    )
+
+# Dimensões com bitmap por valor e medidas agregadas pela camada de consulta dos navios
+DIMENSOES_CONSULTA = ['Serviço', 'Mês', 'Ano']
+MEDIDAS_CONSULTA = {
+    'movs_h': 'Movs_h',
+    'estadia_h': 'Tempo Estadia Porto',
+    'nao_operacional_h': 'Diferença Porto x Operação',
+}
+
+@instrumentado
+def indexar_navios(df, dimensoes=DIMENSOES_CONSULTA, bitmaps=True, periodo=True):
+    """Índices para consultas filtradas sobre os navios (saída de processar_dados_navios_hipoteses)
+
+    Para cada dimensão guarda os códigos das linhas e um bitmap compactado
+    (np.packbits, 1 bit por linha) por valor; a Atracação fica ordenada para
+    recortes de período por busca binária. As medidas são vistas NumPy das
+    colunas de df, que não é copiado. Para uma consulta só, bitmaps=False e
+    periodo=False evitam montar o que ela não usa.
+    """
+    indice = {'linhas': len(df), 'codigos': {}, 'valores': {}, 'bitmaps': {}, 'medidas': {}, 'validas': {}}
+    for dimensao in dimensoes:
+        codigos, valores = pd.factorize(df[dimensao], sort=True)
+        indice['codigos'][dimensao] = codigos
+        indice['valores'][dimensao] = valores
+        if bitmaps:
+            indice['bitmaps'][dimensao] = {valor: np.packbits(codigos == k) for k, valor in enumerate(valores)}
+
+    if periodo:
+        atracacao = df['Atracação'].to_numpy()
+        indice['ordem_atracacao'] = np.argsort(atracacao, kind='stable')
+        indice['atracacao_ordenada'] = atracacao[indice['ordem_atracacao']]
+
+    for nome, coluna in MEDIDAS_CONSULTA.items():
+        valores = df[coluna].to_numpy(dtype='float64', copy=False)
+        indice['medidas'][nome] = valores
+        indice['validas'][nome] = ~np.isnan(valores)
+    # Movs/h só das operações sem flag de intervalo inválido
+    indice['validas']['movs_h'] &= df['Flags_Operacao'].to_numpy() == 0
+    return indice
+
+def filtrar_navios(indice, servicos=None, meses=None, anos=None, inicio=None, fim=None):
+    """Máscara das linhas que atendem a todos os filtros
+
+    Valores de um mesmo filtro se combinam com OU (união dos bitmaps) e filtros
+    diferentes com E; None não filtra. inicio/fim recortam a Atracação (inclusive).
+    Sem bitmaps no índice, a dimensão é filtrada pelos códigos das linhas.
+    """
+    linhas = indice['linhas']
+    mascara = np.full((linhas + 7) // 8, 0xFF, dtype=np.uint8)
+    for dimensao, selecionados in (('Serviço', servicos), ('Mês', meses), ('Ano', anos)):
+        if selecionados is None:
+            continue
+        bitmaps = indice['bitmaps'].get(dimensao)
+        if bitmaps is None:
+            valores = indice['valores'][dimensao]
+            codigos = valores.get_indexer([valor for valor in selecionados if valor in valores])
+            mascara &= np.packbits(np.isin(indice['codigos'][dimensao], codigos))
+            continue
+        uniao = np.zeros_like(mascara)
+        for valor in selecionados:
+            if valor in bitmaps:
+                uniao |= bitmaps[valor]
+        mascara &= uniao
+
+    if inicio is not None or fim is not None:
+        ordenada = indice['atracacao_ordenada']
+        ini = 0 if inicio is None else np.searchsorted(ordenada, np.datetime64(pd.Timestamp(inicio)), 'left')
+        fim = len(ordenada) if fim is None else np.searchsorted(ordenada, np.datetime64(pd.Timestamp(fim)), 'right')
+        janela = np.zeros(linhas, dtype=bool)
+        janela[indice['ordem_atracacao'][ini:fim]] = True
+        mascara &= np.packbits(janela)
+    return np.unpackbits(mascara, count=linhas).astype(bool)
+
+def agregar_navios(indice, mascara, por=None):
+    """Número de navios e médias das medidas (Movs/h, estadia, tempo não operacional) na máscara
+
+    Sem por, retorna um dicionário; com por (uma das DIMENSOES_CONSULTA), um
+    DataFrame com uma linha por valor da dimensão presente na máscara.
+    """
+    if por is None:
+        resultado = {'navios': int(mascara.sum())}
+        for nome, valores in indice['medidas'].items():
+            selecao = mascara & indice['validas'][nome]
+            resultado[nome] = valores[selecao].sum() / selecao.sum() if selecao.any() else np.nan
+        return resultado
 
-def grafico_sazonalidade_movs(df):
+    codigos = indice['codigos'][por]
+    mascara = mascara & (codigos >= 0)
+    n_valores = len(indice['valores'][por])
+    resultado = {'navios': np.bincount(codigos[mascara], minlength=n_valores)}
+    for nome, valores in indice['medidas'].items():
+        selecao = mascara & indice['validas'][nome]
+        soma = np.bincount(codigos[selecao], weights=valores[selecao], minlength=n_valores)
+        contagem = np.bincount(codigos[selecao], minlength=n_valores)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            resultado[nome] = soma / contagem
+    agregado = pd.DataFrame(resultado, index=pd.Index(indice['valores'][por], name=por))
+    return agregado[agregado['navios'] > 0]
+
+@instrumentado
+def grafico_sazonalidade_movs(df, ano=2024):
     """Hipótese 4 - Sazonalidade Movs por mês"""
-    df_2024 = df[df['Ano'] == 2024]
-    movs_mes = df_2024.groupby('Mês')['Movs'].sum().sort_index()
+    df_ano = df[df['Ano'] == ano]
+    movs_mes = df_ano.groupby('Mês')['Movs'].sum().sort_index()
     
     fig = px.bar(
-        x=movs_mes.index,
+        x=rotulos_mes(movs_mes.index),
         y=movs_mes.values,
-        title="Movs por Mês - 2024",
+        title=f"Movs por Mês - {ano}",
         labels={'x': 'Mês', 'y': 'Movs'},
         color_discrete_sequence=['seagreen']
     )
     return fig
 
-def grafico_sazonalidade_comex(df_comex):
+@instrumentado
+def grafico_sazonalidade_comex(df_comex, rollups=None):
     """Hipótese 4 - Sazonalidade Comércio Exterior"""
-    kg_mes = df_comex.groupby('Mês')['Total_2024_Kg'].sum().sort_index()
+    rollups = _rollups(df_comex, rollups)
+    kg_mes = rollups['mes'].sort_index()
     
     fig = px.bar(
         x=kg_mes.index,
         y=kg_mes.values,
-        title="Exportação + Importação por Mês - 2024",
+        title=f"Exportação + Importação por Mês - {rollups['ano']}",
         labels={'x': 'Mês', 'y': 'Kg'},
         color_discrete_sequence=['steelblue']
     )
     return fig
 
-def grafico_eficiencia_servico(df):
-    """Hipótese 6 - Eficiência Operacional por Serviço"""
-    eficiencia = df.groupby('Serviço')['Movs_h'].mean().sort_values(ascending=False).head(10)
+@instrumentado
+def grafico_eficiencia_servico(df, indice=None, servicos=None, meses=None, anos=None):
+    """Hipótese 6 - Eficiência Operacional por Serviço (opcionalmente filtrada via indexar_navios)"""
+    if indice is None:
+        # Sem índice pronto: só as dimensões filtradas, sem bitmaps nem ordenação da Atracação
+        dimensoes = ['Serviço'] + [d for d, filtro in (('Mês', meses), ('Ano', anos)) if filtro is not None]
+        indice = indexar_navios(df, dimensoes, bitmaps=False, periodo=False)
+    por_servico = agregar_navios(indice, filtrar_navios(indice, servicos, meses, anos), por='Serviço')
+    eficiencia = por_servico['movs_h'].dropna().sort_values(ascending=False).head(10)
     
     fig = px.bar(
         x=eficiencia.values,
@@ -381,21 +1615,17 @@ def grafico_eficiencia_servico(df):
     )
     return fig
 
-def grafico_produtos_municipio(df_comex):
+@instrumentado
+def grafico_produtos_municipio(df_comex, rollups=None):
     """Hipótese 6 - Produtos mais exportados por município"""
-    produtos_mun = (
-        df_comex
-        .groupby(['Município', 'Descrição Seção'])['Exportação - 2024 - Valor US$ FOB']
-        .sum()
-        .sort_values(ascending=False)
-        .head(10)
-    )
+    rollups = _rollups(df_comex, rollups)
+    produtos_mun = top_n(rollups['municipio_secao'], 10)
     
     fig = px.bar(
         x=produtos_mun.values,
         y=[f"{idx[0]} – {idx[1]}" for idx in produtos_mun.index],
         orientation='h',
-        title="Top 10 Produtos mais Exportados por Município (2024)",
+        title=f"Top 10 Produtos mais Exportados por Município ({rollups['ano']})",
         labels={'x': 'Valor FOB (US$)', 'y': ''},
         color_discrete_sequence=['purple'],
         height=600,
@@ -409,31 +1639,25 @@ def grafico_produtos_municipio(df_comex):
 
     return fig
 
-def grafico_concentracao_pais(df_comex):
+@instrumentado
+def grafico_concentracao_pais(df_comex, rollups=None):
     """Hipótese 14 - Concentração das Exportações por País"""
-    export_pais = df_comex.groupby('País')['Exportação - 2024 - Valor US$ FOB'].sum().sort_values(ascending=False)
-    total = export_pais.sum()
-    pct = (export_pais / total * 100).round(2)
+    rollups = _rollups(df_comex, rollups)
+    pct = (top_n(rollups['pais'], 10) / rollups['total_exportado'] * 100).round(2)
     
     fig = px.bar(
-        x=pct.head(10).index,
-        y=pct.head(10).values,
-        title="Top 10 Países de Destino - % das Exportações (2024)",
+        x=pct.index,
+        y=pct.values,
+        title=f"Top 10 Países de Destino - % das Exportações ({rollups['ano']})",
         labels={'x': 'País', 'y': 'Percentual (%)'},
         color_discrete_sequence=['steelblue']
     )
-    return fig, pct.head(3).sum()
+    return fig, participacao_top_n(rollups, 3)
 
-def grafico_valor_fob_kg(df_comex):
+@instrumentado
+def grafico_valor_fob_kg(df_comex, rollups=None):
     """Hipótese 8 - Produtos com Maior Valor FOB/kg"""
-    valiosos = df_comex[df_comex['FOB_2024_por_kg'] > 50]
-    top_valiosos = (
-        valiosos
-        .groupby('Descrição Seção')['FOB_2024_por_kg']
-        .mean()
-        .sort_values(ascending=False)
-        .head(10)
-    )
+    top_valiosos = top_n(_rollups(df_comex, rollups)['secao_valor_kg'], 10)
     
     fig = px.bar(
         x=top_valiosos.values,
@@ -451,4 +1675,579 @@ def grafico_valor_fob_kg(df_comex):
     )
     fig.update_yaxes(showticklabels=False)
 
-    return fig
\ No newline at end of file
+    return fig
+
+# Máximo de pontos por traço enviado ao navegador
+MAX_PONTOS_GRAFICO = 2000
+
+def lttb(x, y, n_pontos):
+    """Índices dos pontos escolhidos pelo Largest-Triangle-Three-Buckets (x numérico e crescente)"""
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    n = len(x)
+    if n <= n_pontos or n_pontos < 3:
+        return np.arange(n)
+
+    bordas = np.linspace(1, n - 1, n_pontos - 1).astype(np.intp)
+    selecionados = np.empty(n_pontos, dtype=np.intp)
+    selecionados[0], selecionados[-1] = 0, n - 1
+    anterior = 0
+    for i in range(n_pontos - 2):
+        inicio, fim = bordas[i], bordas[i + 1]
+        prox_fim = bordas[i + 2] if i + 2 < len(bordas) else n
+        media_x, media_y = x[fim:prox_fim].mean(), y[fim:prox_fim].mean()
+        areas = np.abs(
+            (x[anterior] - media_x) * (y[inicio:fim] - y[anterior])
+            - (x[anterior] - x[inicio:fim]) * (media_y - y[anterior])
+        )
+        anterior = inicio + int(np.argmax(areas))
+        selecionados[i + 1] = anterior
+    return selecionados
+
+def reduzir_min_max(y, n_baldes):
+    """Índices do mínimo e do máximo de cada balde (preserva picos da série)"""
+    y = np.asarray(y, dtype='float64')
+    n = len(y)
+    if n <= 2 * n_baldes:
+        return np.arange(n)
+    balde = np.arange(n) * n_baldes // n
+    ordem = np.lexsort((y, balde))
+    inicio_balde = np.flatnonzero(np.r_[True, balde[ordem][1:] != balde[ordem][:-1]])
+    fim_balde = np.r_[inicio_balde[1:], n] - 1
+    return np.unique(np.concatenate([ordem[inicio_balde], ordem[fim_balde]]))
+
+def reduzir_dispersao(x, y, max_pontos):
+    """Índices de até max_pontos pontos, um por célula de uma grade sobre o gráfico
+
+    As bordas das células seguem os quantis de cada eixo (regiões densas ganham
+    mais células e outliers não esticam a grade) e o lado da grade é ajustado por
+    busca binária para o número de células ocupadas ficar perto de max_pontos.
+    """
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    if len(x) <= max_pontos:
+        return np.arange(len(x))
+
+    validos = np.flatnonzero(~(np.isnan(x) | np.isnan(y)))
+    n = len(validos)
+    # Posto de cada valor no eixo (valores iguais ficam com o mesmo posto, e na mesma célula)
+    postos_x = np.searchsorted(np.sort(x[validos]), x[validos])
+    postos_y = np.searchsorted(np.sort(y[validos]), y[validos])
+
+    def primeiros_por_celula(lado):
+        celulas = (postos_x * lado // n) * lado + postos_y * lado // n
+        return np.unique(celulas, return_index=True)[1]
+
+    menor, maior = 1, max(max_pontos, 1)
+    escolhidos = primeiros_por_celula(menor)
+    while menor < maior:
+        lado = (menor + maior + 1) // 2
+        primeiros = primeiros_por_celula(lado)
+        if len(primeiros) <= max_pontos:
+            menor, escolhidos = lado, primeiros
+        else:
+            maior = lado - 1
+    return np.sort(validos[escolhidos])
+
+def _valores_numericos(valores):
+    """Converte um eixo (números ou datas) em float para as reduções"""
+    valores = np.asarray(valores)
+    if np.issubdtype(valores.dtype, np.number):
+        return valores.astype('float64')
+    return pd.to_datetime(valores).asi8.astype('float64')
+
+def _modo_padrao(traco):
+    """Modo que o Plotly usa quando o traço não define mode: 'lines+markers' só com menos de 20 pontos fora de pilha"""
+    if traco.stackgroup is None and len(traco.x) < 20:
+        return 'lines+markers'
+    return 'lines'
+
+def reduzir_figura(fig, max_pontos=MAX_PONTOS_GRAFICO, metodo='lttb', webgl=True):
+    """Limita o número de pontos de cada traço de linha/dispersão de uma figura
+
+    Linhas são reduzidas por LTTB (ou min/max por balde com metodo='min_max'),
+    dispersões por uma grade; dispersões grandes viram Scattergl (WebGL) e os
+    valores numéricos são enviados como float32 (arrays binários no JSON).
+    """
+    tracos = []
+    for traco in fig.data:
+        if (traco.type not in ('scatter', 'scattergl') or traco.x is None or traco.y is None
+                or len(traco.x) <= max_pontos):
+            tracos.append(traco)
+            continue
+
+        x, y = np.asarray(traco.x), np.asarray(traco.y)
+        modo = traco.mode or _modo_padrao(traco)
+        if 'lines' in modo:
+            ordem = np.argsort(_valores_numericos(x), kind='stable')
+            if metodo == 'min_max':
+                indices = ordem[reduzir_min_max(y[ordem], max_pontos // 2)]
+            else:
+                indices = ordem[lttb(_valores_numericos(x)[ordem], y[ordem], max_pontos)]
+        else:
+            indices = reduzir_dispersao(_valores_numericos(x), y, max_pontos)
+
+        dados = traco.to_plotly_json()
+        for chave in ('x', 'y', 'text', 'hovertext', 'customdata'):
+            valores = dados.get(chave)
+            if valores is not None and not isinstance(valores, str) and len(valores) == len(x):
+                dados[chave] = np.asarray(valores)[indices]
+        for chave in ('x', 'y'):
+            valores = dados.get(chave)
+            if isinstance(valores, np.ndarray) and np.issubdtype(valores.dtype, np.number):
+                dados[chave] = valores.astype('float32')
+
+        # Fixa o modo: com menos pontos o padrão do Plotly mudaria a aparência do traço
+        dados['mode'] = modo
+        dados.pop('type', None)
+        tracos.append(go.Scattergl(dados) if webgl and 'markers' in modo else go.Scatter(dados))
+
+    fig.data = []
+    for traco in tracos:
+        fig.add_trace(traco)
+    return fig
+
+@instrumentado
+def grafico_movs_dia(df, max_pontos=MAX_PONTOS_GRAFICO):
+    """Movs por dia de atracação (série reduzida quando passa de max_pontos)"""
+    movs_dia = df.groupby('Dia')['Movs'].sum().sort_index()
+
+    fig = go.Figure(
+        go.Scatter(
+            x=pd.to_datetime(movs_dia.index),
+            y=movs_dia.values,
+            mode='lines',
+            name='Movs',
+            line=dict(color='seagreen')
+        )
+    )
+    fig.update_layout(title_text='Movs por Dia de Atracação', xaxis_title='Dia', yaxis_title='Movs')
+
+    return reduzir_figura(fig, max_pontos)
+
+@instrumentado
+def grafico_dispersao_navios(df, max_pontos=MAX_PONTOS_GRAFICO):
+    """Dispersão por navio: Movs x Tempo de Operação (WebGL, reduzida por grade)"""
+    fig = go.Figure(
+        go.Scattergl(
+            x=df['Tempo de Operação H'].to_numpy(dtype='float32'),
+            y=df['Movs'].to_numpy(dtype='float32'),
+            mode='markers',
+            text=df['Serviço'].astype(str).to_numpy(),
+            name='Navios',
+            marker=dict(color='royalblue', size=5, opacity=0.6)
+        )
+    )
+    fig.update_layout(
+        title_text='Movs x Tempo de Operação por Navio',
+        xaxis_title='Tempo de Operação (Horas)',
+        yaxis_title='Movs'
+    )
+
+    return reduzir_figura(fig, max_pontos)
+
+# Séries do motor de ocupação dos berços
+SERIES_OCUPACAO = ['Navios Atracados', 'Navios em Operação', 'Navios Parados no Berço']
+
+def _extremos_ns(df, coluna):
+    """Datas de uma coluna em ns (int64); NaT vira o menor int64"""
+    return df[coluna].to_numpy(dtype='datetime64[ns]').astype('int64')
+
+def _intervalos_ocupacao(df):
+    """Intervalos (inícios, fins) de cada série de ocupação, por navio
+
+    A operação é recortada ao intervalo de atracação do navio e o tempo parado é
+    o que sobra do intervalo atracado: [Atracação, Início) e [Fim, Desatracação),
+    ou o intervalo inteiro se o navio não tem operação válida. Assim parados nunca
+    fica negativo quando a planilha traz a operação fora da atracação. Intervalos
+    sem data ou invertidos são descartados.
+    """
+    nat = np.iinfo('int64').min
+    atracacao, desatracacao = _extremos_ns(df, 'Atracação'), _extremos_ns(df, 'Desatracação')
+    inicio, fim = _extremos_ns(df, 'Início Operação'), _extremos_ns(df, 'Fim Operação')
+    atracado = (atracacao != nat) & (desatracacao != nat) & (desatracacao >= atracacao)
+    operacao = (inicio != nat) & (fim != nat) & (fim >= inicio)
+
+    # Operação dentro da atracação (navios sem atracação válida mantêm a operação original)
+    inicio = np.where(atracado & operacao, np.maximum(inicio, atracacao), inicio)
+    fim = np.where(atracado & operacao, np.minimum(fim, desatracacao), fim)
+    operacao &= fim >= inicio
+    com_operacao = atracado & operacao
+    sem_operacao = atracado & ~operacao
+
+    parados_inicio = np.concatenate([atracacao[com_operacao], fim[com_operacao], atracacao[sem_operacao]])
+    parados_fim = np.concatenate([inicio[com_operacao], desatracacao[com_operacao], desatracacao[sem_operacao]])
+    return {
+        'Navios Atracados': (atracacao[atracado], desatracacao[atracado]),
+        'Navios em Operação': (inicio[operacao], fim[operacao]),
+        'Navios Parados no Berço': (parados_inicio, parados_fim),
+    }
+
+def _contagem_em(instantes, inicios, fins):
+    """Número de intervalos abertos em cada instante (varredura por busca binária)"""
+    return np.searchsorted(inicios, instantes, side='right') - np.searchsorted(fins, instantes, side='right')
+
+def _tempo_acumulado(instantes, inicios, fins):
+    """Soma, até cada instante, do tempo coberto por todos os intervalos"""
+    soma_inicios = np.r_[0, np.cumsum(inicios, dtype='float64')]
+    soma_fins = np.r_[0, np.cumsum(fins, dtype='float64')]
+    n_inicios = np.searchsorted(inicios, instantes, side='right')
+    n_fins = np.searchsorted(fins, instantes, side='right')
+    t = instantes.astype('float64')
+    return (n_inicios * t - soma_inicios[n_inicios]) - (n_fins * t - soma_fins[n_fins])
+
+@instrumentado
+def calcular_ocupacao(df, freq='h', modo='media'):
+    """Série temporal de navios atracados, em operação e parados no berço
+
+    Monta os intervalos por navio (_intervalos_ocupacao), ordena os inícios e fins
+    uma vez e responde cada instante da grade por busca binária, em O(n log n). Com modo='media' cada período traz a
+    ocupação média ponderada pelo tempo; com modo='instantaneo', a contagem no
+    início do período.
+    """
+    extremos = {nome: (np.sort(inicios), np.sort(fins)) for nome, (inicios, fins) in _intervalos_ocupacao(df).items()}
+    todos_inicios = np.concatenate([inicios for inicios, _ in extremos.values()])
+    todos_fins = np.concatenate([fins for _, fins in extremos.values()])
+    if len(todos_inicios) == 0:
+        return pd.DataFrame(columns=SERIES_OCUPACAO, index=pd.DatetimeIndex([], name='Período'), dtype='float64')
+
+    grade = pd.date_range(
+        pd.Timestamp(todos_inicios.min()).floor(freq),
+        pd.Timestamp(todos_fins.max()).ceil(freq),
+        freq=freq,
+    )
+    instantes = grade.asi8
+    ocupacao = {}
+    for nome, (inicios, fins) in extremos.items():
+        if modo == 'instantaneo':
+            ocupacao[nome] = _contagem_em(instantes, inicios, fins)[:-1].astype('float64')
+        else:
+            # Tempos relativos ao início da grade; o cancelamento das somas acumuladas
+            # ainda deixa ruído da ordem de 1e-9, cortado em zero
+            origem = instantes[0]
+            acumulado = _tempo_acumulado(instantes - origem, inicios - origem, fins - origem)
+            ocupacao[nome] = np.maximum(np.diff(acumulado) / np.diff(instantes), 0)
+
+    return pd.DataFrame(ocupacao, index=pd.DatetimeIndex(grade[:-1], name='Período'))[SERIES_OCUPACAO]
+
+@instrumentado
+def resumo_ocupacao_mensal(ocupacao):
+    """Média e máximo mensal da ocupação (série gerada por calcular_ocupacao)"""
+    return ocupacao.groupby(ocupacao.index.to_period('M')).agg(['mean', 'max'])
+
+@instrumentado
+def grafico_ocupacao(df, freq='D', max_pontos=MAX_PONTOS_GRAFICO):
+    """Ocupação média dos berços: navios atracados, em operação e parados"""
+    ocupacao = calcular_ocupacao(df, freq=freq)
+
+    fig = go.Figure()
+    cores = {
+        'Navios Atracados': 'royalblue',
+        'Navios em Operação': 'mediumseagreen',
+        'Navios Parados no Berço': 'darkorange',
+    }
+    for coluna, cor in cores.items():
+        fig.add_trace(
+            go.Scatter(
+                x=ocupacao.index,
+                y=ocupacao[coluna].to_numpy(),
+                mode='lines',
+                name=coluna,
+                line=dict(color=cor)
+            )
+        )
+    fig.update_layout(
+        title_text='Ocupação Média dos Berços',
+        xaxis_title='Período',
+        yaxis_title='Navios (média no período)',
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        )
+    )
+
+    return reduzir_figura(fig, max_pontos)
+
+def _postos(valores):
+    """Postos (1..n) ao longo do último eixo, com empates recebendo o posto médio"""
+    valores = np.asarray(valores, dtype='float64')
+    ordem = np.argsort(valores, axis=-1, kind='stable')
+    ordenados = np.take_along_axis(valores, ordem, axis=-1)
+    n = valores.shape[-1]
+    posicoes = np.broadcast_to(np.arange(n), valores.shape)
+    diferente = ordenados[..., 1:] != ordenados[..., :-1]
+    verdadeiro = np.ones(valores.shape[:-1] + (1,), dtype=bool)
+    # Primeira e última posição do grupo de empate de cada valor ordenado
+    primeira = np.maximum.accumulate(np.where(np.concatenate([verdadeiro, diferente], axis=-1), posicoes, 0), axis=-1)
+    ultima = np.where(np.concatenate([diferente, verdadeiro], axis=-1), posicoes, n - 1)
+    ultima = np.flip(np.minimum.accumulate(np.flip(ultima, axis=-1), axis=-1), axis=-1)
+    postos = np.empty_like(valores)
+    np.put_along_axis(postos, ordem, (primeira + ultima) / 2 + 1, axis=-1)
+    return postos
+
+def correlacao(x, y, metodo='pearson'):
+    """Correlação de Pearson ou Spearman ao longo do último eixo (aceita lotes de séries)"""
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    if metodo == 'spearman':
+        x, y = _postos(x), _postos(y)
+    elif metodo != 'pearson':
+        raise ValueError(f"Método de correlação desconhecido: {metodo}")
+    x = x - x.mean(axis=-1, keepdims=True)
+    y = y - y.mean(axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (x * y).sum(axis=-1) / np.sqrt((x * x).sum(axis=-1) * (y * y).sum(axis=-1))
+
+def correlacao_movel(x, y, janela, metodo='pearson'):
+    """Correlação em janelas deslizantes de tamanho janela (um valor por janela completa)"""
+    x = np.lib.stride_tricks.sliding_window_view(np.asarray(x, dtype='float64'), janela)
+    y = np.lib.stride_tricks.sliding_window_view(np.asarray(y, dtype='float64'), janela)
+    return correlacao(x, y, metodo)
+
+def ponto_de_mudanca(valores, tamanho_minimo=2):
+    """Ponto que melhor divide a série em dois trechos de médias diferentes (menor soma de quadrados)
+
+    Avalia todos os cortes de uma vez com somas acumuladas. Retorna a posição do
+    primeiro valor do segundo trecho, as médias antes/depois e a fração da
+    variância explicada pelo corte.
+    """
+    valores = np.asarray(valores, dtype='float64')
+    n = len(valores)
+    if n < 2 * tamanho_minimo:
+        return None
+    acumulado = np.cumsum(valores)
+    cortes = np.arange(tamanho_minimo, n - tamanho_minimo + 1)
+    antes = acumulado[cortes - 1]
+    depois = acumulado[-1] - antes
+    # Soma de quadrados explicada por usar duas médias em vez de uma
+    ganho = antes ** 2 / cortes + depois ** 2 / (n - cortes) - acumulado[-1] ** 2 / n
+    melhor = int(np.argmax(ganho))
+    corte = int(cortes[melhor])
+    total = ((valores - valores.mean()) ** 2).sum()
+    return {
+        'posicao': corte,
+        'media_antes': float(valores[:corte].mean()),
+        'media_depois': float(valores[corte:].mean()),
+        'variancia_explicada': float(ganho[melhor] / total) if total > 0 else 0.0,
+    }
+
+# Reamostras do bootstrap são geradas em blocos com sementes independentes, então o
+# resultado é o mesmo rodando em um processo ou em vários
+BLOCOS_BOOTSTRAP = 8
+
+def _bloco_bootstrap(tarefa):
+    """Correlações de um bloco de reamostras (executado no pool de processos)"""
+    x, y, metodo, n_amostras, semente = tarefa
+    rng = np.random.default_rng(semente)
+    indices = rng.integers(0, len(x), size=(n_amostras, len(x)))
+    return correlacao(x[indices], y[indices], metodo)
+
+def intervalo_bootstrap(x, y, metodo='pearson', n_amostras=2000, confianca=0.95, semente=0, processos=1):
+    """Intervalo de confiança percentil da correlação por bootstrap
+
+    As reamostras de cada bloco são avaliadas de uma vez em NumPy; com
+    processos > 1 os blocos rodam em paralelo em um pool de processos.
+    """
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    sementes = np.random.SeedSequence(semente).spawn(BLOCOS_BOOTSTRAP)
+    tamanhos = np.diff(np.linspace(0, n_amostras, BLOCOS_BOOTSTRAP + 1).astype(int))
+    tarefas = [(x, y, metodo, int(tamanho), semente_bloco) for tamanho, semente_bloco in zip(tamanhos, sementes)]
+    if processos == 1:
+        blocos = [_bloco_bootstrap(tarefa) for tarefa in tarefas]
+    else:
+        with ProcessPoolExecutor(max_workers=processos) as executor:
+            blocos = list(executor.map(_bloco_bootstrap, tarefas))
+    amostras = np.concatenate(blocos)
+    alfa = (1 - confianca) / 2
+    return tuple(np.nanquantile(amostras, [alfa, 1 - alfa]))
+
+# Hipóteses avaliadas sobre o cubo mensal: (nome, série x, série y) como (métrica, estatística)
+HIPOTESES_CORRELACAO = [
+    ('Movs x Tempo de Estadia', ('Movs', 'sum'), ('Tempo Estadia Porto', 'sum')),
+    ('Movs x Tempo de Operação', ('Movs', 'sum'), ('Tempo de Operação H', 'sum')),
+]
+# Série em que se procura a mudança de patamar (o salto a partir de outubro)
+SERIE_MUDANCA = ('Diferença Porto x Operação', 'mean')
+
+def series_por_periodo(df, freq='M'):
+    """Cubo (como calcular_cubo_mensal, só soma e média) em baldes de mês ('M') ou dia ('D')"""
+    periodo = df['Atracação'].dt.to_period(freq).rename('Período')
+    return df.groupby(periodo)[METRICAS_CUBO].agg(['sum', 'mean'])
+
+@instrumentado
+def avaliar_hipoteses(cubo, janela=6, n_amostras=2000, confianca=0.95, semente=0, processos=1):
+    """Avalia as hipóteses de correlação e localiza a mudança de patamar
+
+    cubo pode ser o de calcular_cubo_mensal ou o de series_por_periodo. Retorna
+    (tabela, mudanca): a tabela tem Pearson, Spearman, intervalo bootstrap de
+    Pearson, correlação antes/depois da mudança e a correlação móvel mínima;
+    mudanca descreve o corte encontrado em SERIE_MUDANCA.
+    """
+    mudanca = ponto_de_mudanca(cubo[SERIE_MUDANCA].to_numpy())
+    if mudanca is not None:
+        mudanca['periodo'] = cubo.index[mudanca['posicao']]
+
+    linhas = []
+    for nome, coluna_x, coluna_y in HIPOTESES_CORRELACAO:
+        x = cubo[coluna_x].to_numpy(dtype='float64')
+        y = cubo[coluna_y].to_numpy(dtype='float64')
+        inferior, superior = intervalo_bootstrap(x, y, 'pearson', n_amostras, confianca, semente, processos)
+        linha = {
+            'Hipótese': nome,
+            'Pearson': correlacao(x, y),
+            'Spearman': correlacao(x, y, 'spearman'),
+            'IC inferior': inferior,
+            'IC superior': superior,
+            'Correlação móvel mínima': np.nanmin(correlacao_movel(x, y, janela)) if len(x) >= janela else np.nan,
+        }
+        if mudanca is not None:
+            corte = mudanca['posicao']
+            linha['Pearson antes da mudança'] = correlacao(x[:corte], y[:corte])
+            linha['Pearson depois da mudança'] = correlacao(x[corte:], y[corte:])
+        linhas.append(linha)
+    return pd.DataFrame(linhas).set_index('Hipótese'), mudanca
+
+# Pacote de views materializadas (gerado por materializar.py, lido pelo dashboard)
+# raiz/ATUAL aponta para raiz/<versão>/, com um arquivo Arrow IPC por view e o manifest.json
+VERSAO_PACOTE = 1
+ROLLUPS_COMEX_PACOTE = ['pais', 'municipio_secao', 'secao_valor_kg', 'mes']
+
+@instrumentado
+def calcular_views(df, df_comex, ano=2024, quarentena=None):
+    """Calcula as views do pacote a partir dos navios (processar_dados_navios_hipoteses) e do Comex"""
+    rollups = calcular_rollups_comex(df_comex, ano)
+    views = {
+        'navios': df,
+        'navios_quarentena': quarentena if quarentena is not None else pd.DataFrame(),
+        'cubo_mensal': calcular_cubo_mensal(df),
+        'tempo_medio_sem_outliers': calcular_medias_tratadas(df, COLUNAS_TEMPO_MEDIO_TRATADO),
+        'estadia_operacional_sem_outliers': calcular_medias_tratadas(df, COLUNAS_ESTADIA_OPERACAO_TRATADO),
+        'resumo_ocupacao': resumo_ocupacao_mensal(calcular_ocupacao(df)),
+    }
+    views['esbocos_valores'], views['esbocos_estado'] = tabelas_esbocos(calcular_esbocos_mensais(df))
+    for nome in ROLLUPS_COMEX_PACOTE:
+        views[f'comex_{nome}'] = rollups[nome].to_frame()
+    escalares = {'ano': ano, 'total_exportado': int(rollups['total_exportado'])}
+    versoes = {'navios': impressao_digital(df), 'comex': impressao_digital(df_comex)}
+    return views, escalares, versoes
+
+@instrumentado
+def atualizar_views_pacote(pacote, novos, processados=False):
+    """Aplica um lote de navios às views do pacote, refazendo só os meses afetados
+
+    Cubo mensal, médias sem outliers e esboços são atualizados mês a mês; o
+    resumo de ocupação é recalculado inteiro (uma estadia pode cruzar a virada
+    do mês) e as views do Comex são mantidas. Retorna views, escalares e
+    versões para gravar_pacote_views, e os meses afetados.
+    """
+    manifest = pacote['manifest']
+    df, cubo, tempo_medio, meses, esbocos = ingerir_navios_incremental(
+        pacote['navios'], novos, pacote['cubo_mensal'], pacote['tempo_medio_sem_outliers'],
+        processados, esbocos_do_pacote(pacote),
+    )
+    views = {nome: pacote[nome] for nome in manifest['views']}
+    views.update({
+        'navios': df,
+        'cubo_mensal': cubo,
+        'tempo_medio_sem_outliers': tempo_medio,
+        'estadia_operacional_sem_outliers': atualizar_medias_sem_outliers(
+            pacote['estadia_operacional_sem_outliers'], df, meses),
+        'resumo_ocupacao': resumo_ocupacao_mensal(calcular_ocupacao(df)),
+    })
+    if esbocos is not None:
+        views['esbocos_valores'], views['esbocos_estado'] = tabelas_esbocos(esbocos)
+    versoes = {**manifest['versoes'], 'navios': impressao_digital(df)}
+    return views, manifest['escalares'], versoes, meses
+
+@instrumentado
+def gravar_pacote_views(raiz, views, escalares=None, versoes=None):
+    """Grava as views em um novo diretório versionado e só então aponta raiz/ATUAL para ele
+
+    Processos que já leram o pacote anterior continuam com ele; os próximos
+    abrem a nova versão. Retorna o nome da versão.
+    """
+    versoes = versoes or {}
+    digest = hashlib.sha256(json.dumps(versoes, sort_keys=True).encode()).hexdigest()[:12]
+    versao = f"v{VERSAO_PACOTE}-{time.strftime('%Y%m%d%H%M%S')}-{digest}"
+    temporario = os.path.join(raiz, f".{versao}.{os.getpid()}.tmp")
+    os.makedirs(temporario)
+
+    indices_periodo = {}
+    for nome, view in views.items():
+        # O Arrow devolve níveis de índice do tipo Period como inteiros; o manifest guarda a frequência
+        periodos = {str(nivel): view.index.get_level_values(nivel).freqstr
+                    for nivel in range(view.index.nlevels) if isinstance(view.index.get_level_values(nivel), pd.PeriodIndex)}
+        if periodos:
+            indices_periodo[nome] = periodos
+        # Sem compressão: o arquivo é mapeado em memória e lido sem cópia nem decodificação
+        tabela = pa.Table.from_pandas(_tipos_arrow(view))
+        with pa.OSFile(os.path.join(temporario, f"{nome}.arrow"), 'wb') as arquivo:
+            with pa.ipc.new_file(arquivo, tabela.schema) as escritor:
+                escritor.write_table(tabela)
+
+    manifest = {
+        'versao': versao,
+        'versao_formato': VERSAO_PACOTE,
+        'gerado_em': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'views': sorted(views),
+        'indices_periodo': indices_periodo,
+        'escalares': escalares or {},
+        'versoes': versoes,
+    }
+    with open(os.path.join(temporario, 'manifest.json'), 'w', encoding='utf-8') as arquivo:
+        json.dump(manifest, arquivo, ensure_ascii=False, indent=2)
+
+    os.replace(temporario, os.path.join(raiz, versao))
+    ponteiro = os.path.join(raiz, f".ATUAL.{os.getpid()}.tmp")
+    with open(ponteiro, 'w', encoding='utf-8') as arquivo:
+        arquivo.write(versao)
+    os.replace(ponteiro, os.path.join(raiz, 'ATUAL'))
+    return versao
+
+@instrumentado
+def abrir_pacote_views(raiz):
+    """Abre a versão atual do pacote, somente leitura e via memory-map (None se não houver pacote)
+
+    As colunas numéricas dos DataFrames apontam direto para as páginas do
+    arquivo mapeado, compartilhadas pelo page cache entre todos os processos.
+    """
+    try:
+        with open(os.path.join(raiz, 'ATUAL'), encoding='utf-8') as arquivo:
+            diretorio = os.path.join(raiz, arquivo.read().strip())
+        with open(os.path.join(diretorio, 'manifest.json'), encoding='utf-8') as arquivo:
+            manifest = json.load(arquivo)
+    except FileNotFoundError:
+        return None
+    if manifest.get('versao_formato') != VERSAO_PACOTE:
+        return None
+
+    pacote = {'manifest': manifest}
+    for nome in manifest['views']:
+        mapa = pa.memory_map(os.path.join(diretorio, f"{nome}.arrow"), 'r')
+        view = pa.ipc.open_file(mapa).read_all().to_pandas(split_blocks=True)
+        periodos = manifest['indices_periodo'].get(nome)
+        if periodos:
+            niveis = [view.index.get_level_values(nivel) for nivel in range(view.index.nlevels)]
+            for nivel, freq in periodos.items():
+                indice = niveis[int(nivel)]
+                if not isinstance(indice, pd.PeriodIndex):
+                    niveis[int(nivel)] = pd.PeriodIndex.from_ordinals(indice.to_numpy(), freq=freq, name=indice.name)
+            view.index = pd.MultiIndex.from_arrays(niveis) if len(niveis) > 1 else niveis[0]
+        pacote[nome] = view
+    return pacote
+
+def esbocos_do_pacote(pacote):
+    """Esboços mensais de quantis gravados no pacote (None em pacotes gerados antes deles)"""
+    if 'esbocos_estado' not in pacote:
+        return None
+    return esbocos_de_tabelas(pacote['esbocos_valores'], pacote['esbocos_estado'])
+
+def rollups_do_pacote(pacote):
+    """Remonta o dicionário de calcular_rollups_comex a partir das views do pacote"""
+    rollups = {nome: pacote[f'comex_{nome}'].iloc[:, 0] for nome in ROLLUPS_COMEX_PACOTE}
+    rollups.update(pacote['manifest']['escalares'])
+    return rollups
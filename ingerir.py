@@ -0,0 +1,73 @@
+"""Aplica um lote de registros de navios à base particionada e ao pacote de views
+
+Uso: python ingerir.py lote.xlsx [--porto salvador] [--base dados]
+                       [--pacote pacote_views] [--manter 3]
+
+Registros com a mesma chave (navio/viagem e atracação) substituem os gravados.
+Só os meses tocados pelo lote são refeitos: na base particionada são lidas e
+regravadas apenas as partições porto/ano/mês desses meses; no pacote, o cubo
+mensal, as médias sem outliers e os esboços de quantis são atualizados mês a
+mês e gravados como uma nova versão. O cache Parquet não muda: ele espelha a
+planilha de origem, não a base.
+"""
+import argparse
+import os
+
+import pandas as pd
+
+import funcoes
+from materializar import remover_versoes_antigas
+
+def atualizar_particoes(raiz, porto, novos):
+    """Mescla o lote nas partições dos meses que ele toca e regrava só elas
+
+    Retorna os meses afetados e os navios sem Atracação (que não têm partição).
+    """
+    periodos = novos['Mês'].dropna().unique()
+    atual = funcoes.ler_particoes_navios(raiz, portos=[porto], anos=sorted({periodo.year for periodo in periodos}),
+                                         meses=sorted({periodo.month for periodo in periodos}),
+                                         colunas=list(novos.columns))
+    df, meses = funcoes.mesclar_registros_navios(novos.iloc[:0] if atual is None else atual, novos, processados=True)
+    sem_atracacao = funcoes.gravar_particoes_navios(df[df['Mês'].isin(meses)], raiz, porto)
+    return meses, sem_atracacao
+
+def ingerir(path_lote, porto='salvador', base='dados', destino='pacote_views', manter=3):
+    """Aplica o lote à base particionada (se existir) e ao pacote (se existir)
+
+    Retorna os meses afetados, a versão nova do pacote (ou None) e a
+    quarentena do lote.
+    """
+    novos, quarentena = funcoes.load_data(path_lote, usar_cache=False, quarentena=True)
+    meses, versao = pd.Index(novos['Mês']).unique(), None
+
+    raiz = os.path.join(base, 'navios')
+    if os.path.isdir(raiz):
+        meses, sem_atracacao = atualizar_particoes(raiz, porto, novos)
+        if len(sem_atracacao):
+            print(f"Aviso: {len(sem_atracacao)} navio(s) sem Atracação não foram gravados na base: "
+                  f"{', '.join(sem_atracacao['Navio / Viagem'].astype(str))}")
+
+    pacote = funcoes.abrir_pacote_views(destino)
+    if pacote is not None:
+        views, escalares, versoes, meses = funcoes.atualizar_views_pacote(pacote, novos, processados=True)
+        versao = funcoes.gravar_pacote_views(destino, views, escalares, versoes)
+        remover_versoes_antigas(destino, versao, manter)
+    return meses, versao, quarentena
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Aplica um lote de navios à base particionada e ao pacote de views')
+    parser.add_argument('lote', help='planilha com os registros novos ou alterados')
+    parser.add_argument('--porto', default='salvador', help='nome do porto/terminal do lote')
+    parser.add_argument('--base', default='dados', help='raiz da base particionada')
+    parser.add_argument('--pacote', default='pacote_views', help='diretório do pacote de views')
+    parser.add_argument('--manter', type=int, default=3, help='quantas versões do pacote manter')
+    args = parser.parse_args()
+
+    if not os.path.isdir(os.path.join(args.base, 'navios')) and funcoes.abrir_pacote_views(args.pacote) is None:
+        parser.error(f"nem {os.path.join(args.base, 'navios')} nem {args.pacote} existem; rode particionar.py ou materializar.py")
+    meses, versao, quarentena = ingerir(args.lote, args.porto, args.base, args.pacote, args.manter)
+    print(f"Meses atualizados: {', '.join(str(mes) for mes in sorted(meses.dropna()))}")
+    if versao:
+        print(f"Pacote: nova versão {os.path.join(args.pacote, versao)}")
+    if len(quarentena):
+        print(f"Aviso: {len(quarentena)} linha(s) do lote com datas inválidas ficaram em quarentena")
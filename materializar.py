@@ -0,0 +1,52 @@
+"""Gera o pacote de views materializadas usado pelo dashboard
+
+Uso: python materializar.py [--destino pacote_views] [--navios dados_2024_wilson.xlsx]
+                            [--comex dados_comex.xlsx] [--ano 2024] [--manter 3]
+
+Carrega as planilhas uma única vez, calcula o cubo mensal, as médias sem
+outliers, os esboços mensais de quantis, o resumo de ocupação e os rollups do
+Comex Stat e grava tudo em um diretório versionado (Arrow IPC sem compressão).
+O dash.py abre a versão atual via memory-map, sem recalcular nada.
+"""
+import argparse
+import os
+import shutil
+
+import funcoes
+
+def materializar(destino='pacote_views', path_navios='dados_2024_wilson.xlsx',
+                 path_comex='dados_comex.xlsx', ano=2024, manter=3):
+    """Gera uma nova versão do pacote e remove as mais antigas além de manter"""
+    dados, erros = funcoes.carregar_fontes({
+        'navios': (funcoes.load_data, path_navios, True, True),
+        'comex': (funcoes.carregar_dados_comex, path_comex, True, ano),
+    })
+    if erros:
+        raise SystemExit('\n'.join(f"Falha ao carregar '{nome}': {erro}" for nome, erro in erros.items()))
+
+    df, quarentena = dados['navios']
+    df = funcoes.processar_dados_navios_hipoteses(df)
+    views, escalares, versoes = funcoes.calcular_views(df, dados['comex'], ano, quarentena)
+    os.makedirs(destino, exist_ok=True)
+    versao = funcoes.gravar_pacote_views(destino, views, escalares, versoes)
+    remover_versoes_antigas(destino, versao, manter)
+    return versao, views
+
+def remover_versoes_antigas(destino, versao, manter=3):
+    """Remove as versões do pacote além das manter mais recentes (contando a atual)"""
+    # Versões antigas ficam por um tempo para processos que ainda as têm abertas
+    antigas = sorted(nome for nome in os.listdir(destino) if nome.startswith('v') and nome != versao)
+    for nome in antigas[:max(len(antigas) - (manter - 1), 0)]:
+        shutil.rmtree(os.path.join(destino, nome), ignore_errors=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Gera o pacote de views materializadas do dashboard')
+    parser.add_argument('--destino', default='pacote_views', help='diretório do pacote')
+    parser.add_argument('--navios', default='dados_2024_wilson.xlsx', help='planilha de line-up dos navios')
+    parser.add_argument('--comex', default='dados_comex.xlsx', help='planilha do Comex Stat')
+    parser.add_argument('--ano', type=int, default=2024, help='ano das colunas do Comex Stat')
+    parser.add_argument('--manter', type=int, default=3, help='quantas versões manter no diretório')
+    args = parser.parse_args()
+
+    versao, views = materializar(args.destino, args.navios, args.comex, args.ano, args.manter)
+    print(f"{len(views)} views gravadas em {os.path.join(args.destino, versao)}")
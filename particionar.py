@@ -0,0 +1,46 @@
+"""Importa as planilhas para a base particionada por porto/ano/mês
+
+Uso: python particionar.py --porto salvador [--navios dados_2024_wilson.xlsx]
+                           [--comex dados_comex.xlsx] [--destino dados]
+
+Os navios vão para <destino>/navios/porto=<porto>/ano=<ano>/mes=<mes> e o Comex
+Stat para <destino>/comex/ano=<ano>/mes=<mes>. Só as partições presentes na
+planilha importada são substituídas: importar 2025 ou outro terminal não
+regrava (nem deixa mais lentas as consultas de) as partições já existentes.
+Navios sem data de Atracação não têm partição e ficam de fora (com aviso).
+"""
+import argparse
+import os
+
+import pandas as pd
+
+import funcoes
+
+def importar(destino='dados', porto='salvador', path_navios=None, path_comex=None):
+    """Grava as planilhas informadas na base particionada; retorna o número de linhas por base"""
+    linhas = {}
+    if path_navios:
+        df = funcoes.load_data(path_navios)
+        sem_atracacao = funcoes.gravar_particoes_navios(df, os.path.join(destino, 'navios'), porto)
+        if len(sem_atracacao):
+            print(f"Aviso: {len(sem_atracacao)} navio(s) sem Atracação não foram gravados: "
+                  f"{', '.join(sem_atracacao['Navio / Viagem'].astype(str))}")
+        linhas['navios'] = len(df) - len(sem_atracacao)
+    if path_comex:
+        df_comex = pd.read_excel(path_comex)
+        funcoes.gravar_particoes_comex(df_comex, os.path.join(destino, 'comex'))
+        linhas['comex'] = len(df_comex)
+    return linhas
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Importa as planilhas para a base particionada por porto/ano/mês')
+    parser.add_argument('--porto', default='salvador', help='nome do porto/terminal da planilha de navios')
+    parser.add_argument('--navios', help='planilha de line-up dos navios')
+    parser.add_argument('--comex', help='planilha do Comex Stat')
+    parser.add_argument('--destino', default='dados', help='raiz da base particionada')
+    args = parser.parse_args()
+
+    if not args.navios and not args.comex:
+        parser.error('informe --navios e/ou --comex')
+    for base, total in importar(args.destino, args.porto, args.navios, args.comex).items():
+        print(f"{base}: {total} linhas gravadas em {os.path.join(args.destino, base)}")
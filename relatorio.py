@@ -0,0 +1,128 @@
+"""Gera o relatório de hipóteses sem Streamlit
+
+Uso: python relatorio.py [--saida saida_relatorio] [--formato html|json] [--processos N]
+
+Carrega os dados uma vez, gera todos os gráficos em paralelo (pool de
+processos) e grava cada figura em um arquivo estático junto com um manifest.json.
+"""
+import argparse
+import inspect
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import funcoes
+
+# (nome do arquivo, função do gráfico, fonte dos dados)
+GRAFICOS = [
+    ('hipotese_1_movs_estadia', 'grafico_hipoteses', 'navios'),
+    ('hipotese_2_movs_horas_operacao', 'grafico_horasxmovs_mes', 'navios'),
+    ('hipotese_3_diferenca_porto_operacao', 'grafico_dif_porto_operacao', 'navios'),
+    ('hipotese_3_ocupacao_bercos', 'grafico_ocupacao', 'navios'),
+    ('hipotese_4_sazonalidade_movs', 'grafico_sazonalidade_movs', 'navios'),
+    ('hipotese_4_sazonalidade_comex', 'grafico_sazonalidade_comex', 'comex'),
+    ('hipotese_5_eficiencia_servico', 'grafico_eficiencia_servico', 'navios'),
+    ('hipotese_6_produtos_municipio', 'grafico_produtos_municipio', 'comex'),
+    ('hipotese_7_concentracao_pais', 'grafico_concentracao_pais', 'comex'),
+    ('hipotese_8_valor_fob_kg', 'grafico_valor_fob_kg', 'comex'),
+    ('tempo_medio', 'grafico_tempo_medio', 'navios'),
+    ('tempo_medio_sem_outliers', 'grafico_tempo_medio_tratado', 'navios'),
+    ('movs_mes', 'grafico_movs_mes', 'navios'),
+    ('estadia_operacional', 'media_dif_estadia_operacao', 'navios'),
+    ('estadia_operacional_sem_outliers', 'media_dif_estadia_operacao_tratado', 'navios'),
+    ('movs_dia', 'grafico_movs_dia', 'navios'),
+    ('dispersao_navios', 'grafico_dispersao_navios', 'navios'),
+]
+
+# Dados carregados no processo principal e repassados a cada worker uma única vez
+_DADOS = {}
+
+def argumentos_nomeados(funcao, agregacoes):
+    """Pré-agregações (ex.: cubo) aceitas pela função, para passar por nome"""
+    parametros = inspect.signature(funcao).parameters
+    return {nome: valor for nome, valor in agregacoes.items() if nome in parametros}
+
+def _iniciar_worker(dados):
+    """Recebe os dados já processados no início de cada processo"""
+    _DADOS.update(dados)
+
+def carregar_dados_relatorio(path_navios, path_comex):
+    """Carrega os dados (as duas planilhas em paralelo) e as pré-agregações usadas pelos gráficos"""
+    dados, erros = funcoes.carregar_fontes({
+        'navios': (funcoes.load_data, path_navios),
+        'comex': (funcoes.carregar_dados_comex, path_comex),
+    })
+    if erros:
+        raise SystemExit('\n'.join(f"Falha ao carregar '{nome}': {erro}" for nome, erro in erros.items()))
+    df = funcoes.processar_dados_navios_hipoteses(dados['navios'])
+    df_comex = dados['comex']
+    return {
+        'navios': (df,),
+        'comex': (df_comex, funcoes.calcular_rollups_comex(df_comex)),
+        # Passadas por nome a quem aceita (grafico_ocupacao tem freq na segunda posição)
+        'agregacoes': {'cubo': funcoes.calcular_cubo_mensal(df)},
+        'versoes': {
+            'navios': funcoes.impressao_digital(df),
+            'comex': funcoes.impressao_digital(df_comex),
+        },
+    }
+
+def _renderizar(tarefa):
+    """Gera um gráfico e grava o arquivo; retorna a entrada do manifest"""
+    nome, nome_funcao, fonte, saida, formato = tarefa
+    funcao = getattr(funcoes, nome_funcao)
+    resultado = funcao(*_DADOS[fonte], **argumentos_nomeados(funcao, _DADOS['agregacoes']))
+
+    fig, extras = (resultado[0], list(resultado[1:])) if isinstance(resultado, tuple) else (resultado, [])
+    arquivo = f"{nome}.{formato}"
+    if formato == 'html':
+        fig.write_html(os.path.join(saida, arquivo), include_plotlyjs='cdn', full_html=True)
+    else:
+        with open(os.path.join(saida, arquivo), 'w', encoding='utf-8') as f:
+            f.write(fig.to_json())
+
+    return {
+        'nome': nome,
+        'funcao': nome_funcao,
+        'arquivo': arquivo,
+        'titulo': fig.layout.title.text,
+        'extras': [float(valor) for valor in extras],
+    }
+
+def gerar_relatorio(saida='saida_relatorio', formato='html', processos=None,
+                    path_navios='dados_2024_wilson.xlsx', path_comex='dados_comex.xlsx'):
+    """Gera todos os gráficos em paralelo e grava os arquivos e o manifest.json em saida"""
+    os.makedirs(saida, exist_ok=True)
+    dados = carregar_dados_relatorio(path_navios, path_comex)
+    tarefas = [(nome, funcao, fonte, saida, formato) for nome, funcao, fonte in GRAFICOS]
+
+    with ProcessPoolExecutor(max_workers=processos, initializer=_iniciar_worker, initargs=(dados,)) as executor:
+        graficos = list(executor.map(_renderizar, tarefas))
+
+    testes, mudanca = funcoes.avaliar_hipoteses(dados['agregacoes']['cubo'], processos=processos)
+    manifest = {
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'formato': formato,
+        'versoes': dados['versoes'],
+        'graficos': graficos,
+        'testes_hipoteses': {
+            'correlacoes': json.loads(testes.to_json(orient='index')),
+            'ponto_de_mudanca': None if mudanca is None else {**mudanca, 'periodo': str(mudanca['periodo'])},
+        },
+    }
+    with open(os.path.join(saida, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Gera o relatório de hipóteses em arquivos estáticos')
+    parser.add_argument('--saida', default='saida_relatorio', help='diretório de saída')
+    parser.add_argument('--formato', choices=['html', 'json'], default='html')
+    parser.add_argument('--processos', type=int, default=None, help='número de processos (padrão: CPUs)')
+    parser.add_argument('--navios', default='dados_2024_wilson.xlsx', help='planilha de line-up dos navios')
+    parser.add_argument('--comex', default='dados_comex.xlsx', help='planilha do Comex Stat')
+    args = parser.parse_args()
+
+    manifest = gerar_relatorio(args.saida, args.formato, args.processos, args.navios, args.comex)
+    print(f"{len(manifest['graficos'])} gráficos gravados em {args.saida}")
@@ -0,0 +1,68 @@
+"""Propriedades dos esboços de quantis (KLL) usados nos limites IQR aproximados
+
+Uso: python -m pytest -q test_esbocos.py
+"""
+import numpy as np
+import pandas as pd
+
+import funcoes
+
+def _erro_posto(valores_ordenados, estimativas, quantis):
+    """Maior distância entre o posto (0-1) de cada estimativa e o quantil pedido"""
+    postos = np.searchsorted(valores_ordenados, estimativas, side='right') / len(valores_ordenados)
+    return np.max(np.abs(postos - quantis))
+
+def _navios_sinteticos(n_por_mes, meses, semente=0):
+    rng = np.random.default_rng(semente)
+    n = n_por_mes * len(meses)
+    return pd.DataFrame({
+        'Mês': pd.PeriodIndex(np.repeat(meses, n_por_mes), freq='M'),
+        'Movs': rng.integers(50, 2000, n).astype('float64'),
+        'Tempo Estadia Porto': rng.lognormal(3, 0.5, n),
+        'Tempo de Operação H': rng.lognormal(2.5, 0.6, n),
+        'Diferença Porto x Operação': rng.normal(8, 3, n),
+    })
+
+def test_exato_enquanto_nao_compacta():
+    valores = np.random.default_rng(1).normal(size=funcoes.K_ESBOCO)
+    esboco = funcoes.esboco_quantis(valores)
+    quantis = np.linspace(0, 1, 21)
+    assert len(esboco['niveis']) == 1
+    np.testing.assert_array_equal(funcoes.quantis_esboco(esboco, quantis), np.quantile(valores, quantis))
+
+def test_limites_iguais_aos_exatos_em_meses_pequenos():
+    df = _navios_sinteticos(60, ['2024-01', '2024-02', '2024-03'])
+    esbocos = funcoes.calcular_esbocos_mensais(df)
+    for coluna in funcoes.METRICAS_CUBO:
+        pd.testing.assert_frame_equal(
+            funcoes.limites_iqr_esbocos(esbocos, coluna, por_mes=True),
+            funcoes.limites_iqr(df, coluna, por='Mês'),
+            check_names=False,
+        )
+
+def test_mescla_preserva_contagem_e_erro_de_posto():
+    rng = np.random.default_rng(2)
+    partes = [rng.lognormal(0, 1, 5000) for _ in range(20)]
+    esboco = funcoes.mesclar_esbocos(*(funcoes.esboco_quantis(parte) for parte in partes))
+
+    total = sum(len(parte) for parte in partes)
+    assert esboco['n'] == total
+    assert sum(len(nivel) * 2 ** h for h, nivel in enumerate(esboco['niveis'])) == total
+    assert sum(len(nivel) for nivel in esboco['niveis']) < 5 * funcoes.K_ESBOCO
+
+    quantis = np.linspace(0.01, 0.99, 99)
+    erro = _erro_posto(np.sort(np.concatenate(partes)), funcoes.quantis_esboco(esboco, quantis), quantis)
+    assert erro < 0.02
+
+def test_tabelas_do_pacote_remontam_os_esbocos():
+    esbocos = funcoes.calcular_esbocos_mensais(_navios_sinteticos(3000, ['2024-01', '2024-02']))
+    remontados = funcoes.esbocos_de_tabelas(*funcoes.tabelas_esbocos(esbocos))
+
+    assert list(remontados) == list(esbocos)
+    for mes, por_coluna in esbocos.items():
+        for coluna, esboco in por_coluna.items():
+            copia = remontados[mes][coluna]
+            assert (copia['k'], copia['n'], copia['paridade']) == (esboco['k'], esboco['n'], esboco['paridade'])
+            assert len(copia['niveis']) == len(esboco['niveis'])
+            for nivel, original in zip(copia['niveis'], esboco['niveis']):
+                np.testing.assert_array_equal(nivel, original)